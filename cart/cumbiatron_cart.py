@@ -1,17 +1,27 @@
 # cart/cumbiatron_cart.py
 
 import uasyncio as asyncio
+import utime
 from machine import Pin
-from hardware.servo import Servo
-from hardware.stepper import StepperMotor
+from config import settings
+from hardware.servo import Servo, ServoBank, calibrate, save_calibration, load_calibration
+from hardware.stepper import StepperMotorController
 
 class CumbiatronCart:
     def __init__(self, servo_pins, stepper_pins, home_switch_pin, end_switch_pin):
         self.servos = [Servo(pin) for pin in servo_pins]
-        self.stepper = StepperMotor(*stepper_pins)
+        self.servo_bank = ServoBank(self.servos)
+        if load_calibration(self.servos):
+            print("Loaded servo timing calibration")
+        self.stepper = StepperMotorController(*stepper_pins)  # step, dir, enable, mode pins, limit switch
         self.home_switch = Pin(home_switch_pin, Pin.IN, Pin.PULL_UP)
         self.end_switch = Pin(end_switch_pin, Pin.IN, Pin.PULL_UP)
         self.is_homing = False
+        self.homing_switch = None  # Switch that ends the current homing move
+        self.rail_length = settings.RAIL_LENGTH_STEPS
+        self.rail_measured = False  # Until measure_rail runs the end switch position is only nominal
+        self.triggered_switch = None  # Switch that stopped the last move during a performance
+        self.switch_errors = {'home': [], 'end': []}  # Steps off at each switch contact, before correcting
         self.switch_activated = asyncio.Event()
 
         # Set up interrupts for both switches
@@ -22,75 +32,258 @@ class CumbiatronCart:
         self.servo_orientations = [1, 1, 1, 1, -1, -1, -1]  # 1 for left-trigger, -1 for right-trigger
         self.servo_key_types = ['w', 'w', 'w', 'w', 'b', 'b', 'b']  # 'w' for white keys, 'b' for black keys
         self.servo_states = [0] * 7  # 0 for center, -1 for left note, 1 for right note
+        self.hovering = [False] * 7  # Parked just short of a key, see hover()
 
     def switch_handler(self, pin):
-        if not self.is_homing and (pin.value() == 0):  # Switch activated (assuming active low)
+        if pin.value() != 0:  # Switch activated (assuming active low)
+            return
+        if not self.is_homing:
             self.stepper.emergency_stop()
+            self.triggered_switch = pin
             self.switch_activated.set()
+        elif pin is self.homing_switch:
+            self.stepper.emergency_stop()  # Stop on the exact pulse the switch closed
 
     async def initialize(self):
         await self.home()
         await self.center_all_servos()
 
-    async def home(self):
+    async def _seek_switch(self, switch, direction, speed):
+        # Run towards `switch` until it closes; returns the position where it did.
+        # The switch only stops the cart during the seek, so bounce while backing
+        # off it cannot cut the back-off short.
+        if switch.value() == 1:
+            timeout_ms = int(self.rail_length * 1.5 * 1000 / speed) + 1000
+            self.homing_switch = switch
+            try:
+                await self.stepper.move_until_async(direction, speed, timeout_ms, until=lambda: switch.value() == 0,
+                                                    check_limit=False)
+            finally:
+                self.homing_switch = None
+            if switch.value() == 1:
+                raise RuntimeError("Switch not reached while homing")
+        return self.stepper.get_position()
+
+    async def _find_switch(self, switch, direction, seek_speed, approach_speed, backoff_steps, approaches):
+        # Fast seek, then back off and re-approach slowly; returns the slow trigger positions
+        await self._seek_switch(switch, direction, seek_speed)
+        triggers = []
+        for _ in range(approaches):
+            await self.stepper.move_to_steps_async(self.stepper.get_position() - direction * backoff_steps,
+                                                   v_max=seek_speed, check_limit=False)
+            triggers.append(await self._seek_switch(switch, direction, approach_speed))
+        return triggers
+
+    async def home(self, seek_speed=settings.HOMING_SEEK_SPEED, approach_speed=settings.HOMING_APPROACH_SPEED,
+                   backoff_steps=settings.HOMING_BACKOFF_STEPS, approaches=settings.HOMING_APPROACHES):
+        start = utime.ticks_ms()
         self.is_homing = True
         self.switch_activated.clear()
+        try:
+            triggers = await self._find_switch(self.home_switch, -1, seek_speed, approach_speed, backoff_steps, approaches)
+        finally:
+            self.is_homing = False
 
-        # Move left until home switch is activated
-        while self.home_switch.value() == 1:
-            self.stepper.step_left()
-            await asyncio.sleep_ms(1)
-
-        # Move right to clear the home switch
-        while self.home_switch.value() == 0:
-            self.stepper.step_right()
-            await asyncio.sleep_ms(1)
+        # The cart is resting where the last slow approach closed the switch
+        self.stepper.reset_position()
+        report = {
+            'time_ms': utime.ticks_diff(utime.ticks_ms(), start),
+            'spread_steps': max(triggers) - min(triggers),
+        }
+        print(f"Homed in {report['time_ms']} ms, switch repeatability {report['spread_steps']} steps over {len(triggers)} approaches")
+        drift = self.stepper.drift_report()
+        if drift['checks']:
+            print(f"Position drift at home: {drift['last_steps']} steps (worst {drift['max_steps']} over {drift['checks']} checks)")
+        return report
 
-        # Wait for the switch to be activated again
-        while self.home_switch.value() == 1:
-            self.stepper.step_left()
-            await asyncio.sleep_ms(1)
+    async def measure_rail(self, seek_speed=settings.HOMING_SEEK_SPEED, approach_speed=settings.HOMING_APPROACH_SPEED,
+                           backoff_steps=settings.HOMING_BACKOFF_STEPS):
+        # From home, find the end switch the same way and take its position as the rail length
+        self.is_homing = True
+        self.switch_activated.clear()
+        try:
+            triggers = await self._find_switch(self.end_switch, 1, seek_speed, approach_speed, backoff_steps, 1)
+        finally:
+            self.is_homing = False
+        self.rail_length = triggers[-1]
+        self.rail_measured = True
+        print(f"Rail length: {self.rail_length} steps")
+        return self.rail_length
 
-        self.stepper.reset_position()
-        self.is_homing = False
+    async def calibrate_servos(self, reached):
+        # reached(servo, angle) -> True once the servo is at `angle`
+        for index, servo in enumerate(self.servos):
+            await calibrate(servo, reached)
+            print(f"Servo {index}: {servo.dead_ms:.1f} ms dead time, {servo.degrees_per_ms:.2f} degrees/ms")
+        save_calibration(self.servos)
+        await self.center_all_servos()
 
     async def center_all_servos(self):
-        await asyncio.gather(*[servo.center() for servo in self.servos])
+        await self.servo_bank.center_all()
         self.servo_states = [0] * 7
 
+    def _recalibrate(self):
+        # The cart stopped on a switch whose position is known: the difference is
+        # lost (or gained) steps, so record it and carry on from the true position.
+        # Returns the position to carry on from, or None if no switch was hit.
+        switch = self.triggered_switch
+        self.triggered_switch = None
+        if switch is None:
+            return None
+        if switch is self.end_switch and not self.rail_measured:
+            # RAIL_LENGTH_STEPS is nominal, so it is not worth correcting to
+            print("Warning: End switch hit before measure_rail, position left uncorrected")
+            return self.stepper.get_position()
+        name, known = ('home', 0) if switch is self.home_switch else ('end', self.rail_length)
+        error = self.stepper.get_position() - known
+        self.switch_errors[name].append(error)
+        self.stepper.set_position(known)  # Already recorded in switch_errors
+        print(f"Position corrected at {name} switch: {error} steps off")
+        return known
+
+    def switch_report(self) -> dict:
+        report = {}
+        for name, errors in self.switch_errors.items():
+            report[name] = {
+                'checks': len(errors),
+                'max_steps': max(errors, key=abs) if errors else 0,
+                'mean_steps': sum(errors) / len(errors) if errors else 0,
+            }
+        return report
+
     async def move_to_position(self, position):
         self.switch_activated.clear()
         await self.stepper.move_to_position(position)
         if self.switch_activated.is_set():
-            print("Warning: Movement interrupted by switch activation")
+            known = self._recalibrate()
+            if known is not None and 0 <= position <= self.rail_length:
+                # The target is on the rail, so the stop came from lost steps: finish
+                # the move away from the switch that is still pressed
+                self.switch_activated.clear()
+                await self.stepper.move_to_steps_async(position, check_limit=False)
+            if self.switch_activated.is_set():
+                print("Warning: Movement interrupted by switch activation")
 
-    async def play_note(self, servo_index, is_left_note):
-        if servo_index < 0 or servo_index >= len(self.servos):
-            raise ValueError("Invalid servo index")
+    async def queue_move(self, position, on_arrival=None, dwell=None):
+        # Queue a target for run_moves, which blends through consecutive targets.
+        # on_arrival is called as the cart passes the position; dwell is awaited
+        # with the cart stopped there, e.g. to strike at the note's onset.
+        while self.stepper.planner.is_full():
+            await asyncio.sleep_ms(1)
+        self.stepper.queue_target(position, on_arrival=on_arrival, dwell=dwell)
 
-        orientation = self.servo_orientations[servo_index]
-        current_state = self.servo_states[servo_index]
+    async def run_moves(self):
+        # Runs until the queue is empty; targets may be added while it runs. A
+        # switch hit on the way corrects the position and the queue carries on.
+        self.switch_activated.clear()
+        await self.stepper.run_planned(on_stop=self._resume_after_switch)
+        if self.switch_activated.is_set():
+            print("Warning: Movement interrupted by switch activation, queued moves dropped")
+
+    def _resume_after_switch(self):
+        if self._recalibrate() is None:
+            return False
+        self.switch_activated.clear()
+        return True
 
+    def _strike_angle(self, servo_index, is_left_note):
+        orientation = self.servo_orientations[servo_index]
         # Determine the direction to turn
         if (is_left_note and orientation == 1) or (not is_left_note and orientation == -1):
-            target_state = -1
-            angle = -45  # Adjust this value as needed
-        else:
-            target_state = 1
-            angle = 45  # Adjust this value as needed
+            return -1, 90 - settings.SERVO_STRIKE_DEGREES
+        return 1, 90 + settings.SERVO_STRIKE_DEGREES
+
+    def hover(self, notes):
+        # notes: list of (servo_index, is_left_note). Turns each servo to just short
+        # of its strike without waiting, so it can get there while the cart travels
+        angles = [None] * len(self.servos)
+        for servo_index, is_left_note in notes:
+            if servo_index < 0 or servo_index >= len(self.servos):
+                raise ValueError("Invalid servo index")
+            target_state, angle = self._strike_angle(servo_index, is_left_note)
+            if self.servo_states[servo_index] != target_state:
+                angles[servo_index] = self._hover_angle(servo_index, target_state, angle)
+                self.hovering[servo_index] = True
+        self.servo_bank.write_angles(angles)
+
+    def _hover_angle(self, servo_index, target_state, angle):
+        return self.servos[servo_index].reachable_angle(angle) - settings.SERVO_HOVER_DEGREES * target_state
+
+    def hover_ms(self, notes):
+        # How long hover() needs to get every servo from where it is now to its
+        # hover angle; hovering only pays off with at least this much travel
+        hover_ms = 0
+        for servo_index, is_left_note in notes:
+            servo = self.servos[servo_index]
+            target_state, angle = self._strike_angle(servo_index, is_left_note)
+            if self.servo_states[servo_index] != target_state:
+                change = abs(self._hover_angle(servo_index, target_state, angle) - servo.reachable_angle(servo.current_angle))
+                hover_ms = max(hover_ms, servo.settle_ms(change))
+        return hover_ms
+
+    def strike_ms(self, notes, hover=False):
+        # How long before the onset the strike has to start: the slowest servo's
+        # settle time from center, or from its hover angle, to where it strikes
+        strike_ms = 0
+        for servo_index, is_left_note in notes:
+            servo = self.servos[servo_index]
+            target_state, angle = self._strike_angle(servo_index, is_left_note)
+            strike = servo.reachable_angle(angle)
+            start = self._hover_angle(servo_index, target_state, angle) if hover else servo.reachable_angle(90)
+            strike_ms = max(strike_ms, servo.settle_ms(abs(strike - start)))
+        return strike_ms
+
+    def release_ms(self, notes):
+        # How long before a key has to be free the release has to start: the
+        # slowest servo's settle time from its strike angle back to center
+        release_ms = 0
+        for servo_index, is_left_note in notes:
+            servo = self.servos[servo_index]
+            _, angle = self._strike_angle(servo_index, is_left_note)
+            release_ms = max(release_ms, servo.settle_ms(abs(servo.reachable_angle(angle) - servo.reachable_angle(90))))
+        return release_ms
+
+    async def play_note(self, servo_index, is_left_note, hold_ms=0):
+        # hold_ms: how long the servo stays energized afterwards, see Servo.release
+        if servo_index < 0 or servo_index >= len(self.servos):
+            raise ValueError("Invalid servo index")
+
+        target_state, angle = self._strike_angle(servo_index, is_left_note)
 
         # Only move if we're not already in the correct position
-        if current_state != target_state:
-            await self.servos[servo_index].set_angle(angle)
+        if self.servo_states[servo_index] != target_state:
+            await self.servos[servo_index].set_angle(angle, hold_ms)
             self.servo_states[servo_index] = target_state
+            self.hovering[servo_index] = False
 
-    async def release_note(self, servo_index):
+    async def play_chord(self, notes, hold_ms=0):
+        # notes: list of (servo_index, is_left_note), struck together in one actuation;
+        # hold_ms is one value for the chord or a list with one per note
+        angles = [None] * len(self.servos)
+        holds = [0] * len(self.servos)
+        for index, (servo_index, is_left_note) in enumerate(notes):
+            if servo_index < 0 or servo_index >= len(self.servos):
+                raise ValueError("Invalid servo index")
+            target_state, angle = self._strike_angle(servo_index, is_left_note)
+            if self.servo_states[servo_index] != target_state:
+                angles[servo_index] = angle
+                holds[servo_index] = hold_ms[index] if isinstance(hold_ms, list) else hold_ms
+                self.servo_states[servo_index] = target_state
+                self.hovering[servo_index] = False
+        await self.servo_bank.set_angles(angles, holds)
+
+    async def release_note(self, servo_index, hold_ms=0):
         if servo_index < 0 or servo_index >= len(self.servos):
             raise ValueError("Invalid servo index")
 
-        if self.servo_states[servo_index] != 0:
-            await self.servos[servo_index].center()
+        if self.servo_states[servo_index] != 0 or self.hovering[servo_index]:
+            await self.servos[servo_index].center(hold_ms)
             self.servo_states[servo_index] = 0
+            self.hovering[servo_index] = False
+
+    def energized_report(self):
+        # Milliseconds each servo has spent powered, to weigh hold latency against heat
+        return [servo.energized_time_ms() for servo in self.servos]
 
     def get_current_position(self):
         return self.stepper.get_current_position()
@@ -103,7 +296,7 @@ if __name__ == "__main__":
     async def test_cumbiatron():
         # Example pin configurations - adjust as needed
         servo_pins = [0, 1, 2, 3, 4, 5, 6]
-        stepper_pins = [10, 11, 12, 13, 14, 15]
+        stepper_pins = [12, 13, 10, [11, 14, 15], 16]
         home_switch_pin = 16
         end_switch_pin = 17
 
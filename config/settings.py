@@ -0,0 +1,52 @@
+# config/settings.py
+
+# Stepper motion
+STEPPER_TRAVEL_SPEED = 1400  # Steps per second used to estimate cart travel
+STEPPER_START_LATENCY_MS = 5  # Fixed overhead to enable the driver and start PWM
+STEPPER_MAX_SPEED = 2500  # Steps per second the cart can reliably reach
+STEPPER_MAX_ACCELERATION = 20000  # Steps per second squared without losing steps
+STEPPER_JUNCTION_SPEED = 400  # Fastest the cart may pass a key while a servo strikes it
+STEPPER_PLANNER_BUFFER = 16  # Moves the look-ahead planner can hold
+STEPPER_MAX_PULSE_FREQ = 50000  # Highest step pulse rate the driver accepts
+STEPPER_FINE_MICROSTEP = 16  # Microstep mode for slow motion and the final approach (None to disable switching)
+STEPPER_MICROSTEP_SWITCH_SPEED = 300  # Below this many steps per second moves use the fine mode
+STEPPER_APPROACH_STEPS = 20  # Final stretch of every move done in the fine mode
+
+# Homing
+HOMING_SEEK_SPEED = 2000  # Steps per second while looking for a switch
+HOMING_APPROACH_SPEED = 100  # Steps per second for the precise final approach
+HOMING_BACKOFF_STEPS = 50  # How far to back off the switch before re-approaching
+HOMING_APPROACHES = 2  # Slow approaches per homing; more than one measures repeatability
+
+# Servo timing
+SERVO_STRIKE_DEGREES = 45  # How far a servo turns from center to strike a key
+SERVO_DEAD_MS = 6  # Delay before a servo starts turning after a new duty is written
+SERVO_DEGREES_PER_MS = 1.9  # Slew rate once it turns; with the dead time a 45 degree strike takes ~30 ms
+SERVO_HOVER_DEGREES = 10  # How far short of the strike angle a servo waits while the cart travels
+SERVO_HOLD_POLICY = 'auto'  # 'always', 'timed', 'release' or 'auto', see HoldPolicy
+SERVO_HOLD_MS = 250  # Hold time for 'timed'; for 'auto', the longest gap worth staying energized for
+SERVO_CALIBRATION_FILE = 'servo_calibration.json'
+
+# Keyboard geometry, in stepper steps measured from the centre of the lowest key
+KEY_PITCH_STEPS = 100  # Width of one white key
+LOWEST_NOTE = 36  # C2, must be a white key
+HIGHEST_NOTE = 96  # C7
+RAIL_LENGTH_STEPS = 3600  # Usable cart travel; the end switch position once measure_rail has run
+SWITCH_CLEARANCE_STEPS = 10  # Notes are never played this close to where a switch closes
+
+# Cart-relative position of each servo, in the same order as the cart's servos.
+# White servos strike from cart positions on multiples of KEY_PITCH_STEPS; the
+# black servos' offsets are whole key pitches so they strike from the same grid
+# and chords mixing white and black keys can be played from one position.
+SERVO_OFFSETS = [50, 250, 450, 650, 100, 300, 500]
+
+# Compiled plan cache
+PLAN_CACHE_DIR = '.plan_cache'
+PLAN_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+# Notes starting within this window are played as one chord
+CHORD_WINDOW_MS = 20
+
+# Streamed MIDI: a note held longer than this is played with its release cut
+# short here, so one sustained note cannot make the reader buffer the whole song
+STREAM_LOOKAHEAD_MS = 2000
@@ -0,0 +1,84 @@
+# hardware/motion_planner.py
+
+import math
+from config import settings
+from hardware.motion_profile import TrapezoidProfile
+
+class PlannedMove:
+    def __init__(self, start, target, nominal_speed, on_arrival=None, dwell=None):
+        self.start = start
+        self.target = target
+        self.distance = abs(target - start)
+        self.direction = 1 if target >= start else -1
+        self.nominal_speed = nominal_speed
+        self.max_entry_speed = 0
+        self.entry_speed = 0
+        self.exit_speed = 0
+        self.on_arrival = on_arrival
+        self.dwell = dwell  # Coroutine function awaited at the target; the cart stops there for it
+
+    def profile(self, acceleration):
+        return TrapezoidProfile(self.distance, self.nominal_speed, acceleration, self.entry_speed, self.exit_speed)
+
+class MotionPlanner:
+    # Look-ahead buffer of upcoming targets, in the spirit of GRBL's planner. Each
+    # junction gets the fastest speed that still lets every later move stop in
+    # time, so runs of notes in one direction are played without full stops.
+    def __init__(self, max_speed=settings.STEPPER_MAX_SPEED, max_acceleration=settings.STEPPER_MAX_ACCELERATION,
+                 junction_speed=settings.STEPPER_JUNCTION_SPEED, buffer_size=settings.STEPPER_PLANNER_BUFFER):
+        self.max_speed = max_speed
+        self.max_acceleration = max_acceleration
+        self.junction_speed = junction_speed
+        self.buffer_size = buffer_size
+        self.queue = []
+        self.position = 0  # Where the last queued move ends
+        self.current_speed = 0  # Exit speed of the move being executed
+
+    def reset(self, position):
+        self.queue = []
+        self.position = position
+        self.current_speed = 0
+
+    def is_full(self):
+        return len(self.queue) >= self.buffer_size
+
+    def queue_target(self, target, speed=None, on_arrival=None, dwell=None):
+        if self.is_full():
+            raise ValueError("Motion planner buffer is full")
+        move = PlannedMove(self.position, target, min(speed or self.max_speed, self.max_speed), on_arrival, dwell)
+        if self.queue:
+            previous = self.queue[-1]
+            if previous.direction == move.direction and previous.distance and move.distance and previous.dwell is None:
+                move.max_entry_speed = min(self.junction_speed, previous.nominal_speed, move.nominal_speed)
+        self.queue.append(move)
+        self.position = target
+        self.recalculate()
+
+    def recalculate(self):
+        if not self.queue:
+            return
+        a = self.max_acceleration
+
+        # Reverse pass: the last move ends at rest, and every entry must leave
+        # room to slow down to the next junction
+        next_entry = 0
+        for move in reversed(self.queue[1:]):
+            move.exit_speed = next_entry
+            move.entry_speed = min(move.max_entry_speed, math.sqrt(next_entry * next_entry + 2 * a * move.distance))
+            next_entry = move.entry_speed
+        self.queue[0].exit_speed = next_entry
+
+        # Forward pass: no move may need more acceleration than is available
+        first = self.queue[0]
+        first.entry_speed = self.current_speed
+        for index, move in enumerate(self.queue):
+            reachable = math.sqrt(move.entry_speed * move.entry_speed + 2 * a * move.distance)
+            move.exit_speed = min(move.exit_speed, reachable)
+            if index + 1 < len(self.queue):
+                self.queue[index + 1].entry_speed = move.exit_speed
+
+    def pop(self):
+        # The returned move is committed; its exit speed becomes the next entry
+        move = self.queue.pop(0)
+        self.current_speed = move.exit_speed
+        return move
@@ -0,0 +1,212 @@
+# hardware/motion_profile.py
+
+import math
+
+class MotionProfile:
+    # Minimum-time rest-to-rest move over `distance` (steps, or any unit as long
+    # as the limits use the same one). Without `jerk` the profile is trapezoidal,
+    # with it the acceleration ramps up and down linearly (S-curve).
+    def __init__(self, distance, v_max, a_max, jerk=None):
+        self.distance = abs(distance)
+        if self.distance == 0:
+            self.v_peak = self.a_peak = 0
+            self.t_jerk = self.t_accel = self.t_cruise = self.duration = 0
+            return
+
+        if jerk is None:
+            self.t_jerk = 0
+            self.a_peak = a_max
+            v_peak = min(v_max, math.sqrt(self.distance * a_max))
+            t_accel = v_peak / a_max
+        else:
+            # Peak acceleration is limited by how fast jerk can get there and back
+            a_peak = min(a_max, math.sqrt(v_max * jerk))
+            v_peak = v_max
+            if v_peak * (v_peak / a_peak + a_peak / jerk) > self.distance:
+                # Cruise speed not reached; solve v * t_accel(v) = distance
+                v_peak = a_peak * (-a_peak / jerk + math.sqrt((a_peak / jerk) ** 2 + 4 * self.distance / a_peak)) / 2
+                if v_peak < a_peak * a_peak / jerk:
+                    # Not even max acceleration is reached
+                    v_peak = (self.distance * math.sqrt(jerk) / 2) ** (2 / 3)
+                    a_peak = math.sqrt(v_peak * jerk)
+            self.t_jerk = a_peak / jerk
+            self.a_peak = a_peak
+            t_accel = v_peak / a_peak + self.t_jerk
+
+        self.v_peak = v_peak
+        self.t_accel = t_accel
+        self.t_cruise = (self.distance - v_peak * t_accel) / v_peak
+        self.duration = 2 * t_accel + self.t_cruise
+
+    def _accel_speed(self, t):
+        tj, ta = self.t_jerk, self.t_accel
+        if t < tj:
+            return self.a_peak / tj * t * t / 2
+        if t <= ta - tj:
+            return self.a_peak * tj / 2 + self.a_peak * (t - tj)
+        s = ta - t
+        return self.v_peak - (self.a_peak / tj * s * s / 2 if tj else 0)
+
+    def _accel_position(self, t):
+        tj, ta = self.t_jerk, self.t_accel
+        jerk = self.a_peak / tj if tj else 0
+        if t < tj:
+            return jerk * t ** 3 / 6
+        if t <= ta - tj:
+            u = t - tj
+            return jerk * tj ** 3 / 6 + self.a_peak * tj / 2 * u + self.a_peak * u * u / 2
+        s = ta - t
+        return self.v_peak * ta / 2 - (self.v_peak * s - jerk * s ** 3 / 6)
+
+    def speed_at(self, t):
+        if t <= 0 or t >= self.duration:
+            return 0
+        if t < self.t_accel:
+            return self._accel_speed(t)
+        if t <= self.t_accel + self.t_cruise:
+            return self.v_peak
+        return self._accel_speed(self.duration - t)
+
+    def position_at(self, t):
+        if t <= 0:
+            return 0
+        if t >= self.duration:
+            return self.distance
+        if t < self.t_accel:
+            return self._accel_position(t)
+        if t <= self.t_accel + self.t_cruise:
+            return self.v_peak * self.t_accel / 2 + self.v_peak * (t - self.t_accel)
+        return self.distance - self._accel_position(self.duration - t)
+
+    def segments(self, segment_ms=10, min_freq=10):
+        # Split the move into (pulse frequency, pulse count) segments whose counts
+        # add up to exactly `distance`. Slices too short for a whole pulse are merged
+        # into the next one, and very slow segments are run at `min_freq`.
+        result = []
+        slices = max(1, math.ceil(self.duration * 1000 / segment_ms))
+        emitted = 0
+        start = 0
+        for k in range(1, slices + 1):
+            t = self.duration * k / slices
+            pulses = round(self.position_at(t)) - emitted if k < slices else round(self.distance) - emitted
+            if pulses <= 0:
+                continue
+            freq = max(pulses / (t - start), min_freq)
+            result.append((freq, pulses))
+            emitted += pulses
+            start = t
+        return result
+
+class TrapezoidProfile(MotionProfile):
+    # Trapezoidal move that enters at `v_start` and leaves at `v_end`, used to
+    # blend consecutive moves without stopping in between
+    def __init__(self, distance, v_max, a_max, v_start=0, v_end=0):
+        self.distance = abs(distance)
+        self.a_peak = a_max
+        self.v_start = v_start
+        self.v_end = v_end
+        if self.distance == 0:
+            self.v_peak = max(v_start, v_end)
+            self.t_accel = self.t_cruise = self.t_decel = self.duration = 0
+            return
+
+        v_peak = math.sqrt((2 * a_max * self.distance + v_start * v_start + v_end * v_end) / 2)
+        self.v_peak = max(min(v_max, v_peak), v_start, v_end)
+        accel_distance = (self.v_peak ** 2 - v_start ** 2) / (2 * a_max)
+        decel_distance = (self.v_peak ** 2 - v_end ** 2) / (2 * a_max)
+        self.t_accel = (self.v_peak - v_start) / a_max
+        self.t_decel = (self.v_peak - v_end) / a_max
+        self.t_cruise = max(0, self.distance - accel_distance - decel_distance) / self.v_peak
+        self.duration = self.t_accel + self.t_cruise + self.t_decel
+
+    def speed_at(self, t):
+        if t <= 0:
+            return self.v_start
+        if t >= self.duration:
+            return self.v_end
+        if t < self.t_accel:
+            return self.v_start + self.a_peak * t
+        if t <= self.t_accel + self.t_cruise:
+            return self.v_peak
+        return self.v_end + self.a_peak * (self.duration - t)
+
+    def position_at(self, t):
+        if t <= 0:
+            return 0
+        if t >= self.duration:
+            return self.distance
+        if t < self.t_accel:
+            return self.v_start * t + self.a_peak * t * t / 2
+        if t <= self.t_accel + self.t_cruise:
+            return (self.v_start + self.v_peak) / 2 * self.t_accel + self.v_peak * (t - self.t_accel)
+        s = self.duration - t
+        return self.distance - (self.v_end * s + self.a_peak * s * s / 2)
+
+class TravelTimeEstimator:
+    # How long a rest-to-rest move takes under the planner's limits, memoized per
+    # distance bucket. Distances are rounded up to a whole bucket, so estimates
+    # are never short and a whole song only needs a few hundred profiles.
+    def __init__(self, v_max, a_max, jerk=None, start_latency_ms=0, bucket_steps=8, max_entries=512):
+        self.v_max = v_max
+        self.a_max = a_max
+        self.jerk = jerk
+        self.start_latency_ms = start_latency_ms
+        self.bucket_steps = bucket_steps
+        self.max_entries = max_entries
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def estimate_ms(self, from_position, to_position):
+        distance = abs(to_position - from_position)
+        if distance == 0:
+            return 0
+        bucket = math.ceil(distance / self.bucket_steps)
+        travel_ms = self.cache.get(bucket)
+        if travel_ms is not None:
+            self.hits += 1
+            return travel_ms
+
+        self.misses += 1
+        if len(self.cache) >= self.max_entries:
+            self.cache.clear()
+        profile = MotionProfile(bucket * self.bucket_steps, self.v_max, self.a_max, self.jerk)
+        travel_ms = self.start_latency_ms + math.ceil(profile.duration * 1000)
+        self.cache[bucket] = travel_ms
+        return travel_ms
+
+def microstep_segments(profile, start_units, direction, fine_mode, cruise_mode, switch_speed, approach_steps,
+                       max_freq, resolution=32, segment_ms=10, min_freq=10):
+    # Like MotionProfile.segments, but each (frequency, pulse count, microstep)
+    # segment picks its own microstep mode: `cruise_mode` at speed, `fine_mode`
+    # when slow or within `approach_steps` of the target. Positions are counted
+    # in 1/resolution steps from `start_units`; a coarser mode is only entered on
+    # one of its own step boundaries, so the count stays exact across switches.
+    total = round(profile.distance * resolution)
+    slices = max(1, math.ceil(profile.duration * 1000 / segment_ms))
+    result = []
+    done = 0
+    start = 0
+    for k in range(1, slices + 1):
+        t = profile.duration * k / slices
+        goal = round(profile.position_at(t) * resolution) if k < slices else total
+        speed = profile.speed_at((start + t) / 2)
+        if k == slices or (total - done) <= approach_steps * resolution or speed < switch_speed:
+            mode = fine_mode
+        else:
+            mode = cruise_mode
+        while mode > 1 and speed * mode > max_freq:
+            mode //= 2
+        while (start_units + direction * done) % (resolution // mode):
+            mode *= 2
+        if k == slices:
+            while (total - done) % (resolution // mode):
+                mode *= 2
+
+        pulses = (goal - done) // (resolution // mode)
+        if pulses <= 0:
+            continue
+        result.append((max(pulses / (t - start), min_freq), pulses, mode))
+        done += pulses * (resolution // mode)
+        start = t
+    return result
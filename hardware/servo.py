@@ -3,28 +3,93 @@
 import machine
 import utime
 import uasyncio as asyncio
+import math
+import json
+from array import array
+from config import settings
 
 class Servo:
     def __init__(self, pin, min_angle=60, max_angle=120, reversed=False):
         self.pwm = machine.PWM(machine.Pin(pin))
         self.pwm.freq(50)
+        self.reversed = reversed
+        self.offset = 0
+        self.current_angle = 90
+        self.set_limits(min_angle, max_angle)
+        # Settle model: nothing happens for dead_ms, then the horn turns at degrees_per_ms
+        self.dead_ms = settings.SERVO_DEAD_MS
+        self.degrees_per_ms = settings.SERVO_DEGREES_PER_MS
+        # Energized time, so holding servos for latency can be weighed against heat
+        self.energized_since = None
+        self.energized_ms = 0
+        self.writes = 0  # Lets a pending timed disable see that the servo was used again
+
+    def set_limits(self, min_angle, max_angle):
+        if min_angle >= max_angle:
+            raise ValueError("min_angle must be below max_angle.")
         self.min_angle = min_angle
         self.max_angle = max_angle
-        self.reversed = reversed
         self.min_duty = 3000 + (min_angle - 60) * (4000 / 60)
         self.max_duty = 3000 + (max_angle - 60) * (4000 / 60)
-        self.offset = 0
-        self.current_angle = 90
 
-    async def set_angle(self, angle):
+        # Duty for every whole degree of travel, already clamped and reversed, so a
+        # move is one index and one register write with no float math
+        span = max_angle - min_angle
+        self.duty_table = array('H', [0] * (span + 1))
+        for i in range(span + 1):
+            adjusted_angle = max_angle - i if self.reversed else min_angle + i
+            self.duty_table[i] = int(self.min_duty + (self.max_duty - self.min_duty) * (adjusted_angle - min_angle) / span)
+        self.angle_base = min_angle + self.offset  # Requested angle of table entry 0
+        self.duty_index = None  # Until the first write the horn could be anywhere
+
+    def write_angle(self, angle):
+        # Start the move without waiting; returns how far the horn has to turn
+        index = int(angle) - self.angle_base
+        last = len(self.duty_table) - 1
+        if index < 0:
+            index = 0
+        elif index > last:
+            index = last
+        self.pwm.duty_u16(self.duty_table[index])
+        if self.energized_since is None:
+            self.energized_since = utime.ticks_ms()
+        self.writes += 1
         self.current_angle = angle
-        adjusted_angle = max(self.min_angle, min(self.max_angle, angle - self.offset))
-        if self.reversed:
-            adjusted_angle = self.max_angle - (adjusted_angle - self.min_angle)
-        duty = int(self.min_duty + (self.max_duty - self.min_duty) * (adjusted_angle - self.min_angle) / (self.max_angle - self.min_angle))
-        self.pwm.duty_u16(duty)
-        await asyncio.sleep_ms(30)  # Wait for the servo to reach the position
-        self.disable()
+        previous = self.duty_index
+        self.duty_index = index
+        return last if previous is None else abs(index - previous)
+
+    def reachable_angle(self, angle):
+        # The requested angle `angle` ends up at once clamped to the limits
+        return min(max(int(angle), self.angle_base), self.angle_base + len(self.duty_table) - 1)
+
+    def settle_ms(self, angle_change):
+        if angle_change <= 0:
+            return 0
+        return math.ceil(self.dead_ms + angle_change / self.degrees_per_ms)
+
+    def set_timing(self, dead_ms, degrees_per_ms):
+        if dead_ms < 0 or degrees_per_ms <= 0:
+            raise ValueError("Servo timing needs dead_ms >= 0 and degrees_per_ms > 0.")
+        self.dead_ms = dead_ms
+        self.degrees_per_ms = degrees_per_ms
+
+    async def set_angle(self, angle, hold_ms=0):
+        await asyncio.sleep_ms(self.settle_ms(self.write_angle(angle)))  # Wait for the servo to reach the position
+        self.release(hold_ms)
+
+    def release(self, hold_ms=0):
+        # After a move: hold_ms=None keeps the servo energized, 0 disables it now and
+        # anything else disables it that much later unless it has been moved again
+        if hold_ms == 0:
+            self.disable()
+        elif hold_ms is not None:
+            asyncio.create_task(self._disable_after(hold_ms, self.writes))
+
+    async def _disable_after(self, hold_ms, writes):
+        await asyncio.sleep_ms(hold_ms)
+        if self.writes == writes:
+            self.disable()
 
     def get_actual_angle(self):
         actual_angle = max(self.min_angle, min(self.max_angle, self.current_angle - self.offset))
@@ -32,15 +97,103 @@ class Servo:
 
     def disable(self):
         self.pwm.duty_u16(0)
+        if self.energized_since is not None:
+            self.energized_ms += utime.ticks_diff(utime.ticks_ms(), self.energized_since)
+            self.energized_since = None
+
+    def energized_time_ms(self):
+        if self.energized_since is None:
+            return self.energized_ms
+        return self.energized_ms + utime.ticks_diff(utime.ticks_ms(), self.energized_since)
 
     def set_offset(self, offset):
         if -30 <= offset <= 30:
             self.offset = offset
+            self.angle_base = self.min_angle + offset
         else:
             raise ValueError("Offset must be between -30 and 30.")
 
-    async def center(self):
-        await self.set_angle(90)
+    async def center(self, hold_ms=0):
+        await self.set_angle(90, hold_ms)
+
+class ServoBank:
+    # Moves several servos as one: every duty is written in a single pass and the
+    # group shares one settle, as long as the largest move needs
+    def __init__(self, servos):
+        self.servos = servos
+
+    def write_angles(self, angles):
+        # `angles` has one entry per servo, None to leave that servo alone;
+        # returns the settle time the group needs
+        settle_ms = 0
+        for servo, angle in zip(self.servos, angles):
+            if angle is not None:
+                settle_ms = max(settle_ms, servo.settle_ms(servo.write_angle(angle)))
+        return settle_ms
+
+    async def set_angles(self, angles, hold_ms=0):
+        # hold_ms is one value for the whole group or a list with one per servo,
+        # with the same meaning as in Servo.release
+        await asyncio.sleep_ms(self.write_angles(angles))
+        for index, (servo, angle) in enumerate(zip(self.servos, angles)):
+            if angle is not None:
+                servo.release(hold_ms[index] if isinstance(hold_ms, list) else hold_ms)
+
+    async def center_all(self):
+        await self.set_angles([90] * len(self.servos))
+
+async def measure_move_ms(servo, angle, reached, timeout_ms=500):
+    # Time from writing `angle` until `reached(servo, angle)` reports arrival, e.g.
+    # from the servo's feedback potentiometer on an ADC or a key contact
+    start = utime.ticks_us()
+    servo.write_angle(angle)
+    while not reached(servo, angle):
+        if utime.ticks_diff(utime.ticks_us(), start) > timeout_ms * 1000:
+            raise RuntimeError(f"Servo did not reach {angle} degrees within {timeout_ms} ms")
+        await asyncio.sleep_ms(1)
+    return utime.ticks_diff(utime.ticks_us(), start) / 1000
+
+async def calibrate(servo, reached, swings=((90, 95), (90, 105), (90, 120), (60, 120)), repeats=3):
+    # Time each swing a few times and fit settle = dead_ms + change / degrees_per_ms
+    # through the slowest run of each, so the fitted waits are never short
+    samples = []
+    for start, end in swings:
+        worst = 0
+        for _ in range(repeats):
+            await servo.set_angle(start)
+            await asyncio.sleep_ms(100)
+            worst = max(worst, await measure_move_ms(servo, end, reached))
+        samples.append((abs(end - start), worst))
+    servo.disable()
+
+    n = len(samples)
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    spread = sum((x - mean_x) ** 2 for x, _ in samples)
+    if spread == 0:
+        raise ValueError("Calibration needs swings of at least two different sizes.")
+    ms_per_degree = sum((x - mean_x) * (y - mean_y) for x, y in samples) / spread
+    if ms_per_degree <= 0:
+        raise ValueError("Calibration samples do not grow with the swing; check the `reached` probe.")
+    servo.set_timing(max(0, mean_y - ms_per_degree * mean_x), 1 / ms_per_degree)
+    return samples
+
+def save_calibration(servos, path=settings.SERVO_CALIBRATION_FILE):
+    with open(path, 'w') as f:
+        json.dump([[servo.dead_ms, servo.degrees_per_ms] for servo in servos], f)
+
+def load_calibration(servos, path=settings.SERVO_CALIBRATION_FILE):
+    # Returns False, leaving the defaults, when no calibration has been saved yet
+    try:
+        with open(path) as f:
+            timings = json.load(f)
+    except OSError:
+        return False
+    if len(timings) != len(servos):
+        raise ValueError(f"{path} has timings for {len(timings)} servos, expected {len(servos)}")
+    for servo, (dead_ms, degrees_per_ms) in zip(servos, timings):
+        servo.set_timing(dead_ms, degrees_per_ms)
+    return True
 
 # Example usage
 if __name__ == "__main__":
@@ -1,28 +1,76 @@
-from machine import Pin, PWM, Timer
+from machine import Pin, PWM
+from array import array
 import utime
+import uasyncio as asyncio
 import math
+import sys
+from config import settings
+from hardware.motion_profile import MotionProfile, TrapezoidProfile, TravelTimeEstimator, microstep_segments
+from hardware.motion_planner import MotionPlanner
+
+try:
+    from machine import mem32
+except ImportError:
+    mem32 = None
 
 class StepperMotorController:
     MICROSTEP_MODES = {1: (0, 0, 0), 2: (1, 0, 0), 4: (0, 1, 0), 8: (1, 1, 0), 16: (0, 0, 1), 32: (1, 0, 1)}
+    PWM_BASE = 0x40050000  # RP2040 PWM peripheral, one 0x14-byte block per slice
+    MICROSTEP_RESOLUTION = 32  # Finest mode; moves are counted in 1/32 steps
+    RAMP_ROW = 5  # Ramp table rows are (freq, div, wrap, duration_us, microstep)
+    YIELD_GUARD_US = 1000  # Busy-waited tail of each async row
 
-    def __init__(self, step_pin, dir_pin, enable_pin, mode_pins, limit_switch_pin):
+    def __init__(self, step_pin, dir_pin, enable_pin, mode_pins, limit_switch_pin, pulse_counter=None):
         self.step_pin = Pin(step_pin, Pin.OUT)
         self.dir_pin = Pin(dir_pin, Pin.OUT)
         self.enable_pin = Pin(enable_pin, Pin.OUT)
         self.mode_pins = [Pin(pin, Pin.OUT) for pin in mode_pins]
         self.limit_switch = Pin(limit_switch_pin, Pin.IN, Pin.PULL_UP)
+        self.limit_direction = -1  # The limit switch sits at the home end of the rail
         
-        self.position = 0
+        # Position is an integer count of the finest microstep (1/32 step), so it
+        # never drifts from float rounding; `position` gives it in steps
+        self.position_units = 0
+        self.homed = False
+        self.home_drift = []  # Units off at each re-home, before correcting
         self.direction = 1  # 1 for clockwise, -1 for counterclockwise
         self.current_microstep = 1
         
+        # Motion limits, shared with the host-side planning tools through settings
+        self.max_speed = settings.STEPPER_MAX_SPEED
+        self.max_acceleration = settings.STEPPER_MAX_ACCELERATION
+        self.max_pulse_freq = settings.STEPPER_MAX_PULSE_FREQ
+        self.travel_estimator = TravelTimeEstimator(self.max_speed, self.max_acceleration,
+                                                    start_latency_ms=settings.STEPPER_START_LATENCY_MS)
+        
+        # Automatic microstep switching during planned moves
+        self.fine_microstep = settings.STEPPER_FINE_MICROSTEP
+        self.microstep_switch_speed = settings.STEPPER_MICROSTEP_SWITCH_SPEED
+        self.approach_steps = settings.STEPPER_APPROACH_STEPS
+        
         # Initialize PWM for step pin
         self.pwm = PWM(self.step_pin)
         self.pwm.duty_u16(0)  # Start with PWM off
         
-        # Initialize timer for position tracking
-        self.timer = Timer()
-        self.pulse_count = 0
+        # On the RP2040 ramp segments are written straight to the slice registers
+        self.pwm_registers = None
+        if mem32 is not None and sys.platform == 'rp2':
+            self.pwm_registers = (self.PWM_BASE + 0x14 * ((step_pin >> 1) & 7), 16 * (step_pin & 1))
+        
+        # Position comes from the frequency schedule actually commanded, or from a
+        # hardware edge counter on the step pin (e.g. machine.Counter) when given
+        self.pulse_counter = pulse_counter
+        self.last_move_units = 0
+        self.mode_switched = False
+        
+        # Look-ahead buffer for blending consecutive moves
+        self.planner = MotionPlanner(self.max_speed, self.max_acceleration)
+        self.planner_running = False
+        self.handover = None  # (time, units per second) of pulses left running by a blended move
+        
+        # Set from the switch IRQ to end an async move early
+        self.stop_requested = False
+        self.stopped_at_us = 0
         
     def set_direction(self, direction):
         self.direction = 1 if direction > 0 else -1
@@ -42,9 +90,6 @@ class StepperMotorController:
             pin.value(value)
         self.current_microstep = microstep
             
-    def _pulse_counter(self, timer):
-        self.pulse_count += 1
-        
     def _calculate_pwm_parameters(self, freq):
         clock_freq = 125_000_000
         for div in range(1, 256):
@@ -66,25 +111,199 @@ class StepperMotorController:
         
         self.pwm.freq(int(adjusted_freq))
         self.pwm.duty_u16(32768)  # 50% duty cycle
+        return int(adjusted_freq)
+
+    def compile_ramp(self, speed_profile, duration_ms, tick_ms=10):
+        # Sample a speed_profile(t, total_t) callback once, before motion, into a
+        # preallocated table of ready PWM settings for each tick
+        rows = max(1, -(-duration_ms // tick_ms))
+        table = array('I', [0] * (self.RAMP_ROW * rows))
+        for i in range(rows):
+            elapsed_time = i * tick_ms
+            tick_us = min(tick_ms, duration_ms - elapsed_time) * 1000
+            self._store_ramp_row(table, i, speed_profile(elapsed_time, duration_ms) * self.current_microstep, tick_us, self.current_microstep)
+        return table
+
+    def compile_segments(self, segments):
+        # Same table for (pulse frequency, pulse count, microstep) segments
+        table = array('I', [0] * (self.RAMP_ROW * len(segments)))
+        for i, (freq, count, microstep) in enumerate(segments):
+            # Time the row from the integer frequency actually programmed
+            freq = max(int(freq), 10)
+            self._store_ramp_row(table, i, freq, round(count * 1_000_000 / freq), microstep)
+        return table
+
+    def _plan_segments(self, profile, start_units, microstep=None):
+        # Fixed mode when `microstep` is given or switching is disabled, otherwise
+        # cruise in full steps and slow down/approach in the fine mode
+        if microstep is not None or not self.fine_microstep:
+            fine = cruise = microstep or self.current_microstep
+        else:
+            fine, cruise = self.fine_microstep, 1
+        return microstep_segments(profile, start_units, self.direction, fine, cruise, self.microstep_switch_speed,
+                                  self.approach_steps, self.max_pulse_freq, self.MICROSTEP_RESOLUTION)
+
+    def _segment_units(self, segments):
+        return sum(count * (self.MICROSTEP_RESOLUTION // microstep) for _, count, microstep in segments)
+
+    def _plan_move(self, target, v_max, a_max, jerk, microstep):
+        if microstep is not None:
+            self.set_microstep_mode(microstep)
+        fine = microstep or self.fine_microstep or self.current_microstep
+        resolution = self.MICROSTEP_RESOLUTION
+        start_units = self.position_units
+        distance_units = round(target * fine) * (resolution // fine) - start_units
+        if distance_units == 0:
+            return None
+        self.set_direction(distance_units)
+        profile = MotionProfile(abs(distance_units) / resolution, v_max or self.max_speed, a_max or self.max_acceleration, jerk)
+        return self._plan_segments(profile, start_units, microstep)
+
+    def _store_ramp_row(self, table, i, freq, duration_us, microstep):
+        freq = max(freq, 10)  # Ensure minimum frequency of 10 Hz
+        pwm_params = self._calculate_pwm_parameters(freq)
+        if pwm_params is None:
+            raise ValueError(f"Unable to achieve frequency of {freq} Hz")
+        row = i * self.RAMP_ROW
+        table[row] = int(freq)
+        table[row + 1], table[row + 2] = pwm_params
+        table[row + 3] = duration_us
+        table[row + 4] = microstep
+
+    def _apply_ramp_row(self, table, row):
+        if table[row + 4] != self.current_microstep:
+            self.set_microstep_mode(table[row + 4])
+            self.mode_switched = True
+        if self.pwm_registers is None:
+            self.pwm.freq(table[row])
+            self.pwm.duty_u16(32768)  # 50% duty cycle
+            return
+        base, shift = self.pwm_registers
+        wrap = table[row + 2]
+        mem32[base + 0x04] = table[row + 1] << 4  # DIV, integer part
+        mem32[base + 0x10] = wrap - 1  # TOP; the counter period is TOP + 1 cycles
+        mem32[base + 0x0C] = (mem32[base + 0x0C] & (0xFFFF0000 >> shift)) | ((wrap // 2) << shift)  # CC, 50% duty
+
+    def _limit_armed(self):
+        # A switch that is already closed when a move starts (e.g. right after
+        # homing) only stops moves heading further onto it, until it opens again
+        return bool(self.limit_switch.value()) or self.direction == self.limit_direction
+
+    def _run_ramp(self, table, total_units=None):
+        # Blocking counterpart of _run_ramp_async: rows end at absolute ticks_us
+        # deadlines set by the pulse deficit, and the position is integrated over
+        # the time each rate really ran, so a late sleep_us is made up in the next
+        # rows and a completed move is corrected to exactly what was planned
+        self.stop_requested = False
+        self._reset_pulse_count()
+        self.enable()  # Ensure motor is enabled before movement
+        
+        rows = len(table) // self.RAMP_ROW
+        limit_armed = self._limit_armed()
+        planned = 0  # Units x microseconds the rows so far should have emitted
+        units = 0
+        rate = 0  # Units per second the PWM is running at
+        since = utime.ticks_us()  # Pulses are counted up to here
+        completed = False
+        try:
+            for i in range(rows):
+                if self.limit_switch.value():
+                    limit_armed = True
+                elif limit_armed:
+                    break
+                if self.stop_requested:
+                    break
+                row = i * self.RAMP_ROW
+                planned += table[row] * (self.MICROSTEP_RESOLUTION // table[row + 4]) * table[row + 3]
+                now = self._row_end_us()
+                units += rate * utime.ticks_diff(now, since)
+                since = now
+                if units >= planned:
+                    continue  # Still ahead after an overrun
+                self._apply_ramp_row(table, row)
+                # The old rate ran until the new row was written
+                now = self._row_end_us()
+                units += rate * utime.ticks_diff(now, since)
+                since = now
+                rate = table[row] * (self.MICROSTEP_RESOLUTION // table[row + 4])
+                remaining_us = utime.ticks_diff(utime.ticks_add(since, (planned - units) // rate), utime.ticks_us())
+                if remaining_us > 0:
+                    utime.sleep_us(remaining_us)
+            else:
+                completed = True
+        except KeyboardInterrupt:
+            print("Movement interrupted by user.")
+        finally:
+            self.pwm.duty_u16(0)
+            units += rate * max(0, utime.ticks_diff(self._row_end_us(), since))
+            self.disable()
+            actual_steps = self._account_units(round(units / 1_000_000))
+        if completed:
+            self._correct_units((round(planned / 1_000_000) if total_units is None else total_units) - self.last_move_units)
+        return actual_steps
 
     def _stop_motor(self):
         self.pwm.duty_u16(0)
-        self.timer.deinit()
         self.disable()
+
+    def _reset_pulse_count(self):
+        self.mode_switched = False
+        if self.pulse_counter is not None:
+            self.pulse_counter.value(0)
+
+    def _account_units(self, commanded_units):
+        # Prefer the hardware count when there is one; it cannot tell modes apart,
+        # so moves that switched microstep mode use the commanded schedule
+        if self.pulse_counter is not None and not self.mode_switched:
+            commanded_units = self.pulse_counter.value() * (self.MICROSTEP_RESOLUTION // self.current_microstep)
+        self.last_move_units = commanded_units
+        self.position_units += self.direction * commanded_units
+        return self.units_to_steps(commanded_units)
+
+    def steps_to_units(self, steps):
+        return round(steps * self.MICROSTEP_RESOLUTION)
+
+    def units_to_steps(self, units):
+        return units / self.MICROSTEP_RESOLUTION
+
+    @property
+    def position(self):
+        return self.units_to_steps(self.position_units)
+
+    def reset_position(self, position=0):
+        # Called with the cart on a switch at a known `position` (steps). Once
+        # homed, the difference to where we thought we were is recorded as drift.
+        units = self.steps_to_units(position)
+        if self.homed:
+            self.home_drift.append(self.position_units - units)
+        self.set_position(position)
+        self.homed = True
+
+    def set_position(self, position):
+        # Correct the position without recording drift, for callers that keep
+        # their own record of the error
+        self.position_units = self.steps_to_units(position)
+
+    def drift_report(self):
+        if not self.home_drift:
+            return {'checks': 0, 'last_steps': 0, 'max_steps': 0, 'mean_steps': 0}
+        return {
+            'checks': len(self.home_drift),
+            'last_steps': self.units_to_steps(self.home_drift[-1]),
+            'max_steps': self.units_to_steps(max(self.home_drift, key=abs)),
+            'mean_steps': self.units_to_steps(sum(self.home_drift) / len(self.home_drift)),
+        }
         
     def move_for_time(self, direction, steps_per_second, duration_ms, microstep=None):
         if microstep is not None:
             self.set_microstep_mode(microstep)
         
         self.set_direction(direction)
-        self._set_speed(steps_per_second)
-        
-        # Setup pulse counting
-        self.pulse_count = 0
-        self.timer.init(freq=self.pwm.freq()*2, mode=Timer.PERIODIC, callback=self._pulse_counter)
-        
+        self._reset_pulse_count()
         self.enable()  # Ensure motor is enabled before movement
+        freq = self._set_speed(steps_per_second)
         
+        start_us = utime.ticks_us()
         try:
             # Move for the specified duration or until limit switch is triggered
             start_time = utime.ticks_ms()
@@ -93,53 +312,252 @@ class StepperMotorController:
         except KeyboardInterrupt:
             print("Movement interrupted by user.")
         finally:
-            # Stop PWM and timer
             self.pwm.duty_u16(0)
-            self.timer.deinit()
+            elapsed_us = utime.ticks_diff(utime.ticks_us(), start_us)
             self.disable()
         
-        # Update position
-        actual_steps = self.pulse_count / self.current_microstep
-        self.position += self.direction * actual_steps
-        
-        return actual_steps
+        # Update position from the constant frequency we ran at
+        return self._account_units(round(freq * elapsed_us / 1_000_000) * (self.MICROSTEP_RESOLUTION // self.current_microstep))
     
     def move_with_variable_speed(self, direction, speed_profile, duration_ms, microstep=None):
         if microstep is not None:
             self.set_microstep_mode(microstep)
         
         self.set_direction(direction)
-        
-        # Setup pulse counting
-        self.pulse_count = 0
-        self.timer.init(freq=1000, mode=Timer.PERIODIC, callback=self._pulse_counter)
-        
+        ramp = self.compile_ramp(speed_profile, duration_ms)
+        return self._run_ramp(ramp)
+
+    def move_to_steps(self, target, v_max=None, a_max=None, jerk=None, microstep=None):
+        # Plan a minimum-time trapezoidal (or S-curve, with jerk) move that lands
+        # exactly on `target` steps. Without `microstep` the mode switches during
+        # the move between full steps at speed and the fine mode on approach.
+        segments = self._plan_move(target, v_max, a_max, jerk, microstep)
+        if segments is None:
+            return 0
+        return self._run_ramp(self.compile_segments(segments), total_units=self._segment_units(segments))
+
+    def estimate_travel_ms(self, from_position, to_position):
+        # Time for a planned rest-to-rest move between two step positions
+        return self.travel_estimator.estimate_ms(from_position, to_position)
+
+    def emergency_stop(self):
+        # Safe to call from an IRQ handler: cuts the step pulses immediately and
+        # lets the running move account for the time it actually moved
+        self.pwm.duty_u16(0)
+        self.stopped_at_us = utime.ticks_us()
+        self.stop_requested = True
+        self.disable()
+
+    async def _run_ramp_async(self, table, keep_running=False, until=None, check_limit=True, total_units=None):
+        # Each row runs until the pulses emitted so far reach what the table planned
+        # up to its end, so time lost to other coroutines in one row comes out of the
+        # next rows instead of changing the step count. Pulses are integrated over
+        # all the time each rate really ran, row boundaries and a row cut short by
+        # emergency_stop or cancellation included. `until` is polled before every
+        # row and, with `until`, every millisecond; the move ends once it returns
+        # True. `total_units` is the exact length of a segment move, which the
+        # microsecond row durations can only approximate.
+        self.stop_requested = False
+        # Pulses still running from a blended move count towards this one
+        since, rate = self._take_handover()
+        if rate:
+            self.mode_switched = False
+        else:
+            self._reset_pulse_count()
         self.enable()  # Ensure motor is enabled before movement
         
+        rows = len(table) // self.RAMP_ROW
+        limit_armed = self._limit_armed()
+        planned = 0  # Units x microseconds the rows so far should have emitted
+        units = 0
+        completed = False
         try:
-            start_time = utime.ticks_ms()
-            while (utime.ticks_diff(utime.ticks_ms(), start_time) < duration_ms) and self.limit_switch.value():
-                elapsed_time = utime.ticks_diff(utime.ticks_ms(), start_time)
-                current_speed = speed_profile(elapsed_time, duration_ms)
-                self._set_speed(current_speed)
-                utime.sleep_ms(10)  # Small delay to allow for speed changes
-        except KeyboardInterrupt:
-            print("Movement interrupted by user.")
+            for i in range(rows):
+                if check_limit:
+                    if self.limit_switch.value():
+                        limit_armed = True
+                    elif limit_armed:
+                        break
+                if self.stop_requested or (until is not None and until()):
+                    break
+                row = i * self.RAMP_ROW
+                planned += table[row] * (self.MICROSTEP_RESOLUTION // table[row + 4]) * table[row + 3]
+                now = self._row_end_us()
+                units += rate * utime.ticks_diff(now, since)
+                since = now
+                if units >= planned:
+                    continue  # Still ahead after an overrun
+                self._apply_ramp_row(table, row)
+                # The old rate ran until the new row was written
+                now = self._row_end_us()
+                units += rate * utime.ticks_diff(now, since)
+                since = now
+                rate = table[row] * (self.MICROSTEP_RESOLUTION // table[row + 4])
+                await self._wait_until_us(utime.ticks_add(since, (planned - units) // rate), until)
+                if until is not None and until():
+                    break
+            else:
+                completed = True
         finally:
-            # Stop PWM and timer
-            self.pwm.duty_u16(0)
-            self.timer.deinit()
-            self.disable()
-        
-        # Update position
-        actual_steps = self.pulse_count / self.current_microstep
-        self.position += self.direction * actual_steps
-        
+            # A blended move hands over to the next one with the pulses still running
+            if not (keep_running and completed):
+                self.pwm.duty_u16(0)
+            now = self._row_end_us()
+            units += rate * max(0, utime.ticks_diff(now, since))
+            if not (keep_running and completed):
+                self.disable()
+            else:
+                self.handover = (now, rate)
+            actual_steps = self._account_units(round(units / 1_000_000))
+        if completed and not keep_running:
+            self._correct_units((round(planned / 1_000_000) if total_units is None else total_units) - self.last_move_units)
         return actual_steps
 
+    def _take_handover(self):
+        # (time, units per second) of the pulses a blended move left running, for
+        # the next move to count from; nothing is running without one
+        if self.handover is None:
+            return utime.ticks_us(), 0
+        handover = self.handover
+        self.handover = None
+        return handover
+
+    async def _wait_until_us(self, end_us, until=None):
+        # Yield to other coroutines for most of the wait and busy-wait the last
+        # stretch, so a row rarely ends late
+        remaining_us = utime.ticks_diff(end_us, utime.ticks_us())
+        if until is None:
+            await asyncio.sleep_ms(max(0, remaining_us - self.YIELD_GUARD_US) // 1000)
+        else:
+            while remaining_us > self.YIELD_GUARD_US:
+                await asyncio.sleep_ms(1)
+                if self.stop_requested or until():
+                    return
+                remaining_us = utime.ticks_diff(end_us, utime.ticks_us())
+        remaining_us = utime.ticks_diff(end_us, utime.ticks_us())
+        if remaining_us > 0 and not self.stop_requested:
+            utime.sleep_us(remaining_us)
+
+    def _correct_units(self, error_units):
+        # A completed move that still ended off target (a row overran on its last
+        # stretch) gets a short blocking run in the finest mode, backwards when it
+        # overshot, so the position lands exactly on the planned unit count
+        if error_units == 0:
+            return
+        microstep = self.MICROSTEP_RESOLUTION
+        pulses = abs(error_units)
+        if error_units < 0:
+            self.set_direction(-self.direction)
+        freq = self.microstep_switch_speed * microstep
+        table = array('I', [0] * self.RAMP_ROW)
+        self._store_ramp_row(table, 0, freq, 0, microstep)
+        self.enable()
+        self._apply_ramp_row(table, 0)
+        start_us = utime.ticks_us()
+        remaining_us = utime.ticks_diff(utime.ticks_add(start_us, pulses * 1_000_000 // freq), utime.ticks_us())
+        if remaining_us > 0:
+            utime.sleep_us(remaining_us)
+        self.pwm.duty_u16(0)
+        # Count what really ran, in case the sleep overran
+        self.position_units += self.direction * round(freq * utime.ticks_diff(utime.ticks_us(), start_us) / 1_000_000)
+        self.disable()
+
+    def _row_end_us(self):
+        return self.stopped_at_us if self.stop_requested else utime.ticks_us()
+
+    async def move_for_time_async(self, direction, steps_per_second, duration_ms, microstep=None):
+        if microstep is not None:
+            self.set_microstep_mode(microstep)
+        self.set_direction(direction)
+        # Constant speed needs a single row, however long the move
+        ramp = self.compile_ramp(lambda t, total_t: steps_per_second, duration_ms, duration_ms)
+        return await self._run_ramp_async(ramp)
+
+    async def move_until_async(self, direction, steps_per_second, timeout_ms, until=None, check_limit=True, microstep=None):
+        # Accelerate at max_acceleration up to a constant speed and hold it until
+        # `until` returns True, the limit switch closes or timeout_ms runs out. The
+        # table is the few rows of the ramp plus one row for the whole cruise.
+        if microstep is not None:
+            self.set_microstep_mode(microstep)
+        self.set_direction(direction)
+        mode = self.current_microstep
+        freq = steps_per_second * mode
+        acceleration = self.max_acceleration * mode
+        ramp = TrapezoidProfile(freq * freq / (2 * acceleration), freq, acceleration, 0, freq)
+        segments = [(segment_freq, count, mode) for segment_freq, count in ramp.segments()]
+        cruise_ms = max(0, timeout_ms - ramp.duration * 1000)
+        segments.append((freq, max(1, round(freq * cruise_ms / 1000)), mode))
+        return await self._run_ramp_async(self.compile_segments(segments), until=until, check_limit=check_limit)
+
+    async def move_with_variable_speed_async(self, direction, speed_profile, duration_ms, microstep=None):
+        if microstep is not None:
+            self.set_microstep_mode(microstep)
+        self.set_direction(direction)
+        ramp = self.compile_ramp(speed_profile, duration_ms)
+        return await self._run_ramp_async(ramp)
+
+    async def move_to_steps_async(self, target, v_max=None, a_max=None, jerk=None, microstep=None, check_limit=True):
+        segments = self._plan_move(target, v_max, a_max, jerk, microstep)
+        if segments is None:
+            return 0
+        return await self._run_ramp_async(self.compile_segments(segments), check_limit=check_limit,
+                                          total_units=self._segment_units(segments))
+
+    def queue_target(self, target, on_arrival=None, dwell=None):
+        # Add a target to the look-ahead planner; run_planned executes the queue.
+        # on_arrival is called as the cart passes the target, dwell is awaited
+        # with the cart stopped there.
+        if not self.planner.queue and not self.planner_running:
+            self.planner.reset(self.position)
+        self.planner.queue_target(target, on_arrival=on_arrival, dwell=dwell)
+
+    async def run_planned(self, refill=None, on_stop=None):
+        # Execute queued moves back to back, gliding through junctions at the
+        # planned speed. `refill` is called after each move is taken from the
+        # queue so the caller can keep the buffer topped up. When a move is cut
+        # short by emergency_stop, on_stop() may correct the position and return
+        # True to finish that move from rest and carry on with the queue.
+        self.planner_running = True
+        try:
+            while self.planner.queue:
+                move = self.planner.pop()
+                if refill is not None:
+                    refill()
+                # Plan from where the cart really is, so rounding never accumulates
+                move.distance = abs(move.target - self.position)
+                if move.distance:
+                    self.set_direction(move.direction)
+                    segments = self._plan_segments(move.profile(self.max_acceleration), self.position_units)
+                    await self._run_ramp_async(self.compile_segments(segments), keep_running=move.exit_speed > 0,
+                                               total_units=self._segment_units(segments))
+                    if self.stop_requested and on_stop is not None and on_stop():
+                        # Moving off the switch that stopped us must not stop us again
+                        self.stop_requested = False
+                        self.planner.current_speed = 0
+                        self.planner.recalculate()
+                        await self.move_to_steps_async(move.target, check_limit=False)
+                if self.stop_requested:
+                    self.planner.reset(self.position)
+                    break
+                if move.on_arrival is not None:
+                    move.on_arrival()
+                if move.dwell is not None:
+                    await move.dwell()
+        finally:
+            self.planner_running = False
+            self._stop_motor()
+            since, rate = self._take_handover()
+            self.position_units += self.direction * round(rate * max(0, utime.ticks_diff(utime.ticks_us(), since)) / 1_000_000)
+
+    async def move_to_position(self, position):
+        return await self.move_to_steps_async(position)
+
     def get_position(self):
         return self.position
 
+    def get_current_position(self):
+        return self.position
+
 def run_tests(motor):
     print("Starting StepperMotorController tests...")
     
@@ -223,6 +641,11 @@ def run_tests(motor):
             print(f"Total steps moved: {steps_cw + steps_ccw}")
             print(f"Final position: {motor.get_position()}")
             
+        print("\nTest: Planned Moves to Exact Step Targets")
+        for target, jerk in ((400, None), (0, None), (400, 200000), (0, 200000)):
+            steps_moved = motor.move_to_steps(target, jerk=jerk)
+            print(f"  Target {target} (jerk {jerk}): moved {steps_moved:.2f} steps, position {motor.get_position():.2f}")
+        
         # # Test 1: Constant speed
         # print("\nTest 1: Constant Speed")
         # speed = 1000  # steps per second
@@ -331,6 +754,7 @@ def run_tests(motor):
         motor.disable()
         print("\nMotor disabled. Tests completed or interrupted.")
 
-# Create motor instance and run tests
-motor = StepperMotorController(step_pin=12, dir_pin=13, enable_pin=10, mode_pins=[11, 14, 15], limit_switch_pin=16)
-run_tests(motor)
\ No newline at end of file
+if __name__ == "__main__":
+    # Create motor instance and run tests
+    motor = StepperMotorController(step_pin=12, dir_pin=13, enable_pin=10, mode_pins=[11, 14, 15], limit_switch_pin=16)
+    run_tests(motor)
\ No newline at end of file
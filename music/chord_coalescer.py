@@ -0,0 +1,86 @@
+# music/chord_coalescer.py
+
+from typing import List
+from config import settings
+from music.midi_converter import MotionCommand
+
+class ChordCoalescer:
+    # Groups notes that start within a short window into one chord: the notes share
+    # a cart position and onset, so playback does one move and one servo actuation
+    def __init__(self, note_table, servo_count, window_ms=settings.CHORD_WINDOW_MS):
+        self.note_table = note_table
+        self.servo_count = servo_count
+        self.window_ms = window_ms
+        self.report = {}
+
+    def coalesce(self, plan: List[MotionCommand], start_position=0) -> List[MotionCommand]:
+        result = []
+        chords = 0
+        position = start_position
+        i = 0
+        while i < len(plan):
+            group = [plan[i]]
+            while (i + len(group) < len(plan) and len(group) < self.servo_count
+                   and plan[i + len(group)].time_ms - plan[i].time_ms <= self.window_ms):
+                group.append(plan[i + len(group)])
+
+            following = plan[i + len(group)].position if i + len(group) < len(plan) else None
+            chord = self._place(group, position, following) if len(group) > 1 else None
+            if chord is not None:
+                result.extend(chord)
+                chords += 1
+            else:
+                result.extend(group)
+            position = result[-1].position
+            i += len(group)
+
+        moves_before = self._count_moves(plan, start_position)
+        moves_after = self._count_moves(result, start_position)
+        self.report = {'chords': chords, 'moves_before': moves_before, 'moves_after': moves_after,
+                       'moves_saved': moves_before - moves_after}
+        return result
+
+    def _travel(self, positions, position, following):
+        travel = 0
+        for next_position in positions + ([following] if following is not None else []):
+            travel += abs(next_position - position)
+            position = next_position
+        return travel
+
+    def _place(self, group, position, following):
+        # Try every position one of the notes can be played from, least travel from
+        # the previous note to the next one first. The path optimizer has already
+        # chosen positions, so a chord that would add travel is not formed; on a
+        # tie the position the notes already have wins.
+        current = self._travel([command.position for command in group], position, following)
+        candidates = {option[0] for command in group for option in self.note_table[command.note]}
+        costs = {candidate: self._travel([candidate], position, following) for candidate in candidates}
+        ranked = sorted((candidate for candidate in candidates if costs[candidate] <= current),
+                        key=lambda candidate: (costs[candidate], candidate != group[0].position))
+        for candidate in ranked:
+            choices = [[option for option in self.note_table[command.note] if option[0] == candidate] for command in group]
+            assignment = self._assign(choices, [], set())
+            if assignment is not None:
+                onset = group[0].time_ms
+                return [command._replace(time_ms=onset, position=candidate, servo_index=servo_index, direction=direction)
+                        for command, (_, servo_index, direction) in zip(group, assignment)]
+        return None
+
+    def _assign(self, choices, assignment, used_servos):
+        # Every note in the chord needs its own servo
+        if len(assignment) == len(choices):
+            return assignment
+        for option in choices[len(assignment)]:
+            if option[1] not in used_servos:
+                result = self._assign(choices, assignment + [option], used_servos | {option[1]})
+                if result is not None:
+                    return result
+        return None
+
+    def _count_moves(self, plan, position):
+        moves = 0
+        for command in plan:
+            if command.position != position:
+                moves += 1
+                position = command.position
+        return moves
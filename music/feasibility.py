@@ -0,0 +1,100 @@
+# music/feasibility.py
+
+import math
+import numpy as np
+from typing import List
+from config import settings
+from music.midi_converter import MotionCommand
+
+class FeasibilityAnalyzer:
+    # Finds the notes the cart cannot physically reach in time, using the same
+    # speed and acceleration limits as StepperMotorController
+    def __init__(self, max_speed=settings.STEPPER_MAX_SPEED, max_acceleration=settings.STEPPER_MAX_ACCELERATION,
+                 strike_ms=None, release_ms=None, note_table=None, max_delay_ms=50):
+        self.max_speed = max_speed
+        self.max_acceleration = max_acceleration
+        # By default the servo settle model for a full strike, which takes as
+        # long out to the key as back to center
+        settle_ms = math.ceil(settings.SERVO_DEAD_MS + settings.SERVO_STRIKE_DEGREES / settings.SERVO_DEGREES_PER_MS)
+        self.strike_ms = settle_ms if strike_ms is None else strike_ms
+        self.release_ms = settle_ms if release_ms is None else release_ms
+        self.note_table = note_table  # Needed for octave-fold suggestions
+        self.max_delay_ms = max_delay_ms
+
+    def min_travel_ms(self, distance: np.ndarray) -> np.ndarray:
+        # Rest-to-rest trapezoidal move; short moves never reach max speed
+        distance = np.abs(np.asarray(distance, dtype=float))
+        v, a = self.max_speed, self.max_acceleration
+        triangular = distance < v * v / a
+        seconds = np.where(triangular, 2 * np.sqrt(distance / a), distance / v + v / a)
+        return seconds * 1000
+
+    def analyze(self, plan: List[MotionCommand], start_position=0, suggest=False) -> dict:
+        times = np.array([command.time_ms for command in plan], dtype=float)
+        positions = np.array([command.position for command in plan], dtype=float)
+
+        previous_positions = np.concatenate(([start_position], positions[:-1]))
+        distance = positions - previous_positions
+        required = self.min_travel_ms(distance)
+
+        # Between two notes the cart has to wait for the previous strike, lift the
+        # key and still issue the next strike early; the first note has a free lead-in
+        available = np.diff(times, prepend=-np.inf) - self.strike_ms - self.release_ms
+        required = np.where(distance == 0, 0.0, required)
+        available = np.where(distance == 0, np.inf, available)
+        slack = available - required
+
+        infeasible = np.flatnonzero(slack < 0)
+        report = {
+            'notes': len(plan),
+            'slack_ms': slack,
+            'required_ms': required,
+            'infeasible': infeasible,
+            'worst_slack_ms': float(slack.min()) if len(plan) else 0.0,
+        }
+        if suggest:
+            report['suggestions'] = [self._suggest(plan, index, previous_positions[index], available[index], slack[index])
+                                     for index in infeasible]
+        return report
+
+    def _suggest(self, plan, index, previous_position, available, slack):
+        # Prefer playing the note an octave away, then a short delay, then dropping it
+        command = plan[index]
+        if self.note_table is not None:
+            best = None
+            for note in (command.note - 12, command.note + 12):
+                if 0 <= note < 128:
+                    for option in self.note_table[note]:
+                        option_slack = available - self.min_travel_ms(option[0] - previous_position)
+                        if option_slack >= 0 and (best is None or option_slack > best[0]):
+                            best = (option_slack, note, option)
+            if best is not None:
+                return (index, 'fold', best[1], best[2])
+        if -slack <= self.max_delay_ms:
+            return (index, 'delay', int(np.ceil(-slack)), None)
+        return (index, 'drop', command.note, None)
+
+    def summary(self, report: dict) -> str:
+        lines = [f"{len(report['infeasible'])} of {report['notes']} notes infeasible, "
+                 f"worst slack {report['worst_slack_ms']:.1f} ms"]
+        for index, action, value, option in report.get('suggestions', []):
+            if action == 'fold':
+                lines.append(f"  note #{index}: play {value} instead (position {option[0]}, servo {option[1]})")
+            elif action == 'delay':
+                lines.append(f"  note #{index}: delay by {value} ms")
+            else:
+                lines.append(f"  note #{index}: drop note {value}")
+        return '\n'.join(lines)
+
+# Example usage: python -m music.feasibility song.mid
+if __name__ == "__main__":
+    import sys
+    from music.midi_converter import MidiConverter
+    from music.note_mapping import KeyboardGeometry, build_note_table
+    from music.path_optimizer import PathOptimizer
+
+    # Servo layout of CumbiatronCart
+    note_table = build_note_table(KeyboardGeometry(), [1, 1, 1, 1, -1, -1, -1], ['w', 'w', 'w', 'w', 'b', 'b', 'b'])
+    plan = PathOptimizer(note_table).optimize(MidiConverter(note_table).compile(sys.argv[1]))
+    analyzer = FeasibilityAnalyzer(note_table=note_table)
+    print(analyzer.summary(analyzer.analyze(plan, suggest=True)))
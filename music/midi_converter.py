@@ -0,0 +1,113 @@
+# music/midi_converter.py
+
+import mido
+from collections import namedtuple
+from typing import Iterable, Iterator, List
+from config import settings
+
+# A note read from the MIDI file, with absolute onset and release times in ms
+NoteEvent = namedtuple('NoteEvent', ['time_ms', 'note', 'release_ms', 'track'])
+
+# A precompiled cart action: move to `position`, strike with `servo_index`
+# (direction -1 for a left note, 1 for a right note) and release at `release_ms`
+MotionCommand = namedtuple('MotionCommand', ['time_ms', 'position', 'servo_index', 'direction', 'release_ms', 'note'])
+
+DEFAULT_TEMPO = 500000  # Microseconds per beat (120 bpm)
+
+class MidiConverter:
+    def __init__(self, note_table: list, max_lookahead_ms=settings.STREAM_LOOKAHEAD_MS):
+        self.note_table = note_table  # note -> tuple of (position, servo_index, direction) options
+        self.max_lookahead_ms = max_lookahead_ms  # How far stream_notes reads past a held note
+        self.skipped_notes = []
+
+    def extract_notes(self, midi_file_path: str) -> List[NoteEvent]:
+        midi_file = mido.MidiFile(midi_file_path)
+
+        # Tag every message with its absolute tick and track, then merge the tracks
+        events = []
+        for track_index, track in enumerate(midi_file.tracks):
+            tick = 0
+            for msg in track:
+                tick += msg.time
+                events.append((tick, track_index, msg))
+        events.sort(key=lambda event: event[0])
+
+        notes = []
+        open_notes = {}  # (channel, note) -> list of (onset_ms, track)
+        tempo = DEFAULT_TEMPO
+        last_tick = 0
+        seconds = 0.0
+        for tick, track_index, msg in events:
+            seconds += mido.tick2second(tick - last_tick, midi_file.ticks_per_beat, tempo)
+            last_tick = tick
+            time_ms = int(round(seconds * 1000))
+
+            if msg.type == 'set_tempo':
+                tempo = msg.tempo
+            elif msg.type == 'note_on' and msg.velocity > 0:
+                open_notes.setdefault((msg.channel, msg.note), []).append((time_ms, track_index))
+            elif msg.type == 'note_off' or msg.type == 'note_on':
+                pending = open_notes.get((msg.channel, msg.note))
+                if pending:
+                    onset_ms, onset_track = pending.pop(0)
+                    notes.append(NoteEvent(onset_ms, msg.note, time_ms, onset_track))
+
+        # Notes never switched off are released at the end of the song
+        end_ms = int(round(seconds * 1000))
+        for (_, note), pending in open_notes.items():
+            for onset_ms, onset_track in pending:
+                notes.append(NoteEvent(onset_ms, note, end_ms, onset_track))
+
+        notes.sort(key=lambda event: (event.time_ms, event.note))
+        return notes
+
+    def compile_notes(self, notes: List[NoteEvent]) -> List[MotionCommand]:
+        self.skipped_notes = []
+        commands = []
+        for event in notes:
+            options = self.note_table[event.note]
+            if not options:
+                self.skipped_notes.append(event.note)
+                continue
+            # Start from the default option; alternatives are left to the path optimizer
+            position, servo_index, direction = options[0]
+            commands.append(MotionCommand(event.time_ms, position, servo_index, direction, event.release_ms, event.note))
+        return commands
+
+    def stream_notes(self, events: Iterable) -> Iterator[NoteEvent]:
+        # Pair note on/off events from a MidiStreamReader as they arrive. A note is
+        # yielded once it and every earlier note have been released, or once the
+        # reader is max_lookahead_ms past its onset; a note still held then is
+        # released there. Only the last max_lookahead_ms of notes stay in memory.
+        pending = []  # [onset_ms, note, release_ms, track] in onset order
+        open_notes = {}  # (channel, note) -> pending entries waiting for a note off
+        time_ms = 0
+        for time_ms, is_note_on, note, channel, track in events:
+            if is_note_on:
+                entry = [time_ms, note, None, track]
+                pending.append(entry)
+                open_notes.setdefault((channel, note), []).append(entry)
+            else:
+                waiting = open_notes.get((channel, note))
+                if waiting:
+                    waiting.pop(0)[2] = time_ms
+            while pending and (pending[0][2] is not None or time_ms - pending[0][0] > self.max_lookahead_ms):
+                entry = pending.pop(0)
+                yield NoteEvent(entry[0], entry[1], entry[2] if entry[2] is not None else time_ms, entry[3])
+
+        for entry in pending:
+            yield NoteEvent(entry[0], entry[1], entry[2] if entry[2] is not None else time_ms, entry[3])
+
+    def stream(self, events: Iterable) -> Iterator[MotionCommand]:
+        # Like compile_notes, but lazily, so playback can start after the first few events
+        for event in self.stream_notes(events):
+            options = self.note_table[event.note]
+            if options:
+                position, servo_index, direction = options[0]
+                yield MotionCommand(event.time_ms, position, servo_index, direction, event.release_ms, event.note)
+
+    def compile(self, midi_file_path: str) -> List[MotionCommand]:
+        commands = self.compile_notes(self.extract_notes(midi_file_path))
+        if self.skipped_notes:
+            print(f"Skipped {len(self.skipped_notes)} unreachable notes: {sorted(set(self.skipped_notes))}")
+        return commands
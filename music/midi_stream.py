@@ -0,0 +1,127 @@
+# music/midi_stream.py
+
+import heapq
+from typing import Iterator, Tuple
+from music.midi_converter import DEFAULT_TEMPO
+
+# A note on/off read from the file: (time_ms, is_note_on, note, channel, track)
+StreamEvent = Tuple[int, bool, int, int, int]
+
+class _ChunkReader:
+    # Reads one track chunk through a fixed-size buffer, so memory does not grow with the file
+    def __init__(self, path, offset, length, chunk_size):
+        self.file = open(path, 'rb')
+        self.file.seek(offset)
+        self.remaining = length
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.index = 0
+
+    def read_byte(self):
+        if self.index >= len(self.buffer):
+            if self.remaining <= 0:
+                raise EOFError
+            self.buffer = self.file.read(min(self.chunk_size, self.remaining))
+            if not self.buffer:
+                raise EOFError
+            self.remaining -= len(self.buffer)
+            self.index = 0
+        value = self.buffer[self.index]
+        self.index += 1
+        return value
+
+    def skip(self, count):
+        for _ in range(count):
+            self.read_byte()
+
+    def read_varlen(self):
+        value = 0
+        while True:
+            byte = self.read_byte()
+            value = (value << 7) | (byte & 0x7F)
+            if not byte & 0x80:
+                return value
+
+    def close(self):
+        self.file.close()
+
+class MidiStreamReader:
+    def __init__(self, midi_file_path: str, chunk_size=1024):
+        self.path = midi_file_path
+        self.chunk_size = chunk_size
+
+        # Only the chunk headers are read up front; track data stays on disk
+        with open(midi_file_path, 'rb') as f:
+            header = f.read(14)
+            if header[:4] != b'MThd':
+                raise ValueError(f"{midi_file_path} is not a MIDI file")
+            header_length = int.from_bytes(header[4:8], 'big')
+            division = int.from_bytes(header[12:14], 'big')
+            if division & 0x8000:
+                raise ValueError("SMPTE time division is not supported")
+            self.ticks_per_beat = division
+
+            self.tracks = []  # (offset, length) of every track chunk
+            f.seek(8 + header_length)
+            while True:
+                chunk_header = f.read(8)
+                if len(chunk_header) < 8:
+                    break
+                length = int.from_bytes(chunk_header[4:8], 'big')
+                if chunk_header[:4] == b'MTrk':
+                    self.tracks.append((f.tell(), length))
+                f.seek(length, 1)
+
+    def _track_events(self, track_index, offset, length):
+        # Yields (tick, track, kind, note_or_tempo, velocity, channel) for the events we use
+        reader = _ChunkReader(self.path, offset, length, self.chunk_size)
+        tick = 0
+        status = 0
+        try:
+            while True:
+                tick += reader.read_varlen()
+                byte = reader.read_byte()
+                if byte & 0x80:
+                    status = byte
+                    data = None
+                else:
+                    data = byte  # Running status: this was already the first data byte
+
+                if status == 0xFF:
+                    meta_type = reader.read_byte()
+                    meta_length = reader.read_varlen()
+                    if meta_type == 0x51 and meta_length == 3:
+                        tempo = (reader.read_byte() << 16) | (reader.read_byte() << 8) | reader.read_byte()
+                        yield (tick, track_index, 'tempo', tempo, 0, 0)
+                    else:
+                        reader.skip(meta_length)
+                        if meta_type == 0x2F:
+                            return
+                    status = 0
+                elif status in (0xF0, 0xF7):
+                    reader.skip(reader.read_varlen())
+                    status = 0
+                else:
+                    kind = status & 0xF0
+                    first = data if data is not None else reader.read_byte()
+                    second = 0 if kind in (0xC0, 0xD0) else reader.read_byte()
+                    if kind == 0x90 or kind == 0x80:
+                        yield (tick, track_index, 'note', first, second if kind == 0x90 else 0, status & 0x0F)
+        except EOFError:
+            return
+        finally:
+            reader.close()
+
+    def events(self) -> Iterator[StreamEvent]:
+        # Merge the tracks lazily by tick and convert ticks to ms as tempo changes arrive
+        tracks = [self._track_events(i, offset, length) for i, (offset, length) in enumerate(self.tracks)]
+        tempo = DEFAULT_TEMPO
+        last_tick = 0
+        time_us = 0
+        for tick, track_index, kind, value, velocity, channel in heapq.merge(*tracks, key=lambda event: event[0]):
+            time_us += (tick - last_tick) * tempo / self.ticks_per_beat
+            last_tick = tick
+            if kind == 'tempo':
+                tempo = value
+            else:
+                yield (int(round(time_us / 1000)), velocity > 0, value, channel, track_index)
@@ -1,66 +1,134 @@
 # music/music_interpreter.py
 
-import mido
 from typing import List, Tuple
+from music.midi_converter import MidiConverter, MotionCommand, NoteEvent
+from music.midi_stream import MidiStreamReader
+from music.score_format import write_score
+from music.score_player import ScorePlayer
+from music.playback import PlaybackEngine, LatencyModel
+from utils.async_helpers import asyncio, ticks_ms, ticks_add
+from music.path_optimizer import PathOptimizer
+from music.note_mapping import KeyboardGeometry, build_note_table
+from music.plan_cache import PlanCache
+from music.partitioner import ScorePartitioner
+from music.chord_coalescer import ChordCoalescer
+from config import settings
 
 class MusicInterpreter:
-    def __init__(self, cart):
+    def __init__(self, cart, plan_cache: PlanCache = None):
         self.cart = cart
+        self.plan_cache = plan_cache or PlanCache()
+        self.note_table = build_note_table(KeyboardGeometry(), cart.servo_orientations, cart.servo_key_types)
         self.note_mapping = self._create_note_mapping()
+        self.converter = MidiConverter(self.note_table)
+        self.latency = LatencyModel(estimator=cart.stepper.travel_estimator)
+        self.engine = PlaybackEngine(cart, self.latency)
+        self.player = ScorePlayer(cart, self.engine)
+        self.optimizer = PathOptimizer(self.note_table, self.latency)
+        self.coalescer = ChordCoalescer(self.note_table, len(cart.servos))
 
     def _create_note_mapping(self) -> dict:
-        # Map MIDI note numbers to (position, servo_index) tuples
-        # This is a simplified mapping and should be adjusted based on your specific setup
-        return {
-            60: (0, 0),    # C4
-            62: (100, 0),  # D4
-            64: (200, 1),  # E4
-            65: (300, 1),  # F4
-            67: (400, 2),  # G4
-            69: (500, 2),  # A4
-            71: (600, 3),  # B4
-            72: (700, 3),  # C5
-            # Add more mappings as needed
-        }
+        # Map MIDI note numbers to the default (position, servo_index) for each reachable note
+        return {note: options[0][:2] for note, options in enumerate(self.note_table) if options}
+
+    def compile(self, midi_file_path: str) -> List[MotionCommand]:
+        with open(midi_file_path, 'rb') as f:
+            midi_bytes = f.read()
+        return self._compile(midi_file_path, midi_bytes, lambda: self.converter.compile(midi_file_path))
+
+    def compile_notes(self, label: str, midi_bytes: bytes, notes: List[NoteEvent]) -> List[MotionCommand]:
+        # Same pipeline for a subset of a song's notes, e.g. one cart's part; the
+        # notes themselves are part of the cache key
+        return self._compile(label, midi_bytes, lambda: self.converter.compile_notes(notes), notes)
+
+    def _compile(self, label, midi_bytes, convert, *key_parts) -> List[MotionCommand]:
+        start_position = self.cart.get_current_position()
+        config = sorted((name, getattr(settings, name)) for name in dir(settings) if name.isupper())
+        key = self.plan_cache.key(midi_bytes, config, self.note_table, start_position, *key_parts)
+
+        plan = self.plan_cache.get(key)
+        if plan is not None:
+            print(f"Plan cache hit for {label} ({self.plan_cache.stats()})")
+            return plan
+        print(f"Plan cache miss for {label} ({self.plan_cache.stats()})")
+
+        plan = convert()
+        plan = self.optimizer.optimize(plan, start_position)
+        report = self.optimizer.report
+        print(f"Path optimizer saved {report['saved_distance']} steps "
+              f"({report['naive_distance']} -> {report['optimized_distance']}), ~{report['saved_ms']} ms of travel")
+        plan = self.coalescer.coalesce(plan, start_position)
+        report = self.coalescer.report
+        print(f"Coalesced {report['chords']} chords, saving {report['moves_saved']} of {report['moves_before']} cart moves")
+        self.plan_cache.put(key, plan)
+        return plan
 
     async def play_midi_file(self, midi_file_path: str):
-        midi_file = mido.MidiFile(midi_file_path)
-        
-        for msg in midi_file.play():
-            if msg.type == 'note_on' and msg.velocity > 0:
-                await self._play_note(msg.note)
-            elif msg.type == 'note_off' or (msg.type == 'note_on' and msg.velocity == 0):
-                await self._release_note(msg.note)
-
-    async def _play_note(self, note: int):
-        if note in self.note_mapping:
-            position, servo_index = self.note_mapping[note]
-            await self.cart.play_note(position, servo_index, 45)  # Adjust angle as needed
-            print(f"Playing note {note} at position {position} with servo {servo_index}")
-        else:
-            print(f"Note {note} not in mapping")
+        # Compile the whole file up front so playback does no parsing or lookups
+        plan = self.compile(midi_file_path)
+        await self.play_plan(plan)
 
-    async def _release_note(self, note: int):
-        if note in self.note_mapping:
-            _, servo_index = self.note_mapping[note]
-            await self.cart.servos[servo_index].set_angle(90)  # Return to neutral position
-            print(f"Releasing note {note}")
+    async def stream_midi_file(self, midi_file_path: str):
+        # Start playing straight away for files too long to compile up front.
+        # Notes use their default option since the path optimizer needs the whole song.
+        events = MidiStreamReader(midi_file_path).events()
+        await self.play_plan(self.converter.stream(events))
+
+    def export_score(self, midi_file_path: str, score_path: str) -> int:
+        # Compile once on the host and write the binary score that the board plays
+        return write_score(score_path, self.compile(midi_file_path))
+
+    async def play_score(self, score_path: str):
+        # The board plays scores through ScorePlayer directly, without this module's mido imports
+        await self.player.play_score(score_path)
+
+    async def play_plan(self, plan: List[MotionCommand], start=None):
+        await self.player.play_plan(plan, start)
 
     async def play_chord(self, notes: List[int]):
-        positions_and_servos = [self.note_mapping.get(note) for note in notes if note in self.note_mapping]
-        if positions_and_servos:
-            avg_position = sum(pos for pos, _ in positions_and_servos) // len(positions_and_servos)
-            await self.cart.move_to_position(avg_position)
-            
-            servo_angles = [90] * len(self.cart.servos)  # Start with all servos at neutral
-            for _, servo_index in positions_and_servos:
-                servo_angles[servo_index] = 45  # Adjust angle as needed
-            
-            await self.cart.play_chord(servo_angles)
+        chord = [MotionCommand(0, options[0][0], options[0][1], options[0][2], 0, note)
+                 for note, options in ((note, self.note_table[note]) for note in notes) if options]
+        chord = self.coalescer.coalesce(chord, self.cart.get_current_position())
+        if chord and all(command.position == chord[0].position for command in chord):
+            await self.cart.move_to_position(chord[0].position)
+            await self.cart.play_chord([(command.servo_index, command.direction < 0) for command in chord])
             print(f"Playing chord: {notes}")
         else:
             print("No playable notes in the chord")
 
+class MultiCartInterpreter:
+    # Drives several carts at once, each playing its own share of the song
+    def __init__(self, carts, analyzer=None):
+        self.interpreters = [MusicInterpreter(cart) for cart in carts]
+        if analyzer is None:
+            # Imported here so numpy is only needed when several carts share a song
+            from music.feasibility import FeasibilityAnalyzer
+            analyzer = FeasibilityAnalyzer(note_table=self.interpreters[0].note_table)
+        self.analyzer = analyzer
+        self.partitioner = ScorePartitioner(self.interpreters[0].note_table, analyzer)
+
+    def compile(self, midi_file_path: str, strategy='pitch') -> List[List[MotionCommand]]:
+        # Each cart's part goes through the same optimize, coalesce and cache
+        # pipeline as a single-cart song
+        with open(midi_file_path, 'rb') as f:
+            midi_bytes = f.read()
+        notes = self.interpreters[0].converter.extract_notes(midi_file_path)
+        parts = self.partitioner.split(notes, len(self.interpreters), strategy)
+        plans = []
+        for index, (interpreter, part) in enumerate(zip(self.interpreters, parts)):
+            plan = interpreter.compile_notes(f"{midi_file_path} cart {index}", midi_bytes, part)
+            infeasible = self.analyzer.analyze(plan, interpreter.cart.get_current_position())['infeasible']
+            print(f"Cart {index}: {len(plan)} notes, {len(infeasible)} infeasible")
+            plans.append(plan)
+        return plans
+
+    async def play_midi_file(self, midi_file_path: str, strategy='pitch'):
+        plans = self.compile(midi_file_path, strategy)
+        # One clock for every cart, with enough lead-in for the slowest first move
+        lead_in_ms = max(interpreter.engine.required_lead_in_ms(plan) for interpreter, plan in zip(self.interpreters, plans))
+        start = ticks_add(ticks_ms(), lead_in_ms)
+        await asyncio.gather(*[interpreter.play_plan(plan, start) for interpreter, plan in zip(self.interpreters, plans)])
+
 # Example usage
 if __name__ == "__main__":
     import asyncio
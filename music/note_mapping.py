@@ -0,0 +1,72 @@
+# music/note_mapping.py
+
+from config import settings
+
+WHITE_SEMITONES = (0, 2, 4, 5, 7, 9, 11)
+
+class KeyboardGeometry:
+    def __init__(self, key_pitch=settings.KEY_PITCH_STEPS, lowest_note=settings.LOWEST_NOTE,
+                 highest_note=settings.HIGHEST_NOTE, rail_length=settings.RAIL_LENGTH_STEPS,
+                 servo_offsets=settings.SERVO_OFFSETS, switch_clearance=settings.SWITCH_CLEARANCE_STEPS):
+        if lowest_note % 12 not in WHITE_SEMITONES:
+            raise ValueError("The lowest key must be a white key")
+        self.key_pitch = key_pitch
+        self.lowest_note = lowest_note
+        self.highest_note = highest_note
+        self.rail_length = rail_length
+        self.servo_offsets = servo_offsets
+        self.switch_clearance = switch_clearance  # Positions near either switch would trip it
+
+    def key_type(self, note):
+        return 'w' if note % 12 in WHITE_SEMITONES else 'b'
+
+    def key_position(self, note):
+        # Centre of a key relative to the lowest key; black keys sit on the
+        # boundary between the two white keys around them
+        white_keys = self._white_index(note) - self._white_index(self.lowest_note)
+        position = white_keys * self.key_pitch
+        if self.key_type(note) == 'b':
+            position += self.key_pitch // 2
+        return position
+
+    def _white_index(self, note):
+        octave, semitone = divmod(note, 12)
+        return octave * 7 + sum(1 for white in WHITE_SEMITONES if white <= semitone) - 1
+
+def build_note_table(geometry, servo_orientations, servo_key_types):
+    # Dense 128-entry table: table[note] is a tuple of every (position, servo_index,
+    # direction) that plays the note, or () when the note cannot be reached.
+    # Each servo sits between two keys of its type and strikes the left one
+    # (direction -1) or the right one (direction 1); the side matching the
+    # servo's orientation comes first, so the first option is the default.
+    half_pitch = geometry.key_pitch // 2
+    table = []
+    for note in range(128):
+        if note < geometry.lowest_note or note > geometry.highest_note:
+            table.append(())
+            continue
+
+        key_type = geometry.key_type(note)
+        key_position = geometry.key_position(note)
+        preferred = []
+        others = []
+        for servo_index, (offset, orientation, servo_type) in enumerate(zip(geometry.servo_offsets, servo_orientations, servo_key_types)):
+            if servo_type != key_type:
+                continue
+            for direction in (-1, 1):
+                position = key_position - offset - direction * half_pitch
+                if geometry.switch_clearance <= position <= geometry.rail_length - geometry.switch_clearance:
+                    option = (position, servo_index, direction)
+                    if direction == -orientation:
+                        preferred.append(option)
+                    else:
+                        others.append(option)
+        table.append(tuple(preferred + others))
+
+    # Mixed chords need white and black keys playable from a shared position
+    grids = [{option[0] % geometry.key_pitch for note, options in enumerate(table) for option in options
+              if geometry.key_type(note) == key_type} for key_type in ('w', 'b')]
+    if grids[0] and grids[1] and not grids[0] & grids[1]:
+        print("Warning: servo offsets put white and black keys on different cart positions; "
+              "chords mixing them will be split")
+    return table
@@ -0,0 +1,87 @@
+# music/partitioner.py
+
+from typing import List
+from music.midi_converter import MidiConverter, MotionCommand, NoteEvent
+from music.path_optimizer import PathOptimizer
+
+class ScorePartitioner:
+    # Splits a song's notes across several carts so each one only plays what it
+    # can keep up with. With a FeasibilityAnalyzer, pitch boundaries are shifted
+    # until the cart with the most infeasible notes cannot be improved further.
+    def __init__(self, note_table, analyzer=None, max_rounds=24):
+        self.converter = MidiConverter(note_table)
+        self.optimizer = PathOptimizer(note_table)
+        self.analyzer = analyzer
+        self.max_rounds = max_rounds
+        self.report = []
+
+    def partition_by_track(self, notes: List[NoteEvent], cart_count: int) -> List[List[NoteEvent]]:
+        # Largest tracks first, each to the cart with the fewest notes so far
+        tracks = {}
+        for event in notes:
+            tracks.setdefault(event.track, []).append(event)
+        parts = [[] for _ in range(cart_count)]
+        for track_notes in sorted(tracks.values(), key=len, reverse=True):
+            min(parts, key=len).extend(track_notes)
+        for part in parts:
+            part.sort(key=lambda event: (event.time_ms, event.note))
+        return parts
+
+    def partition_by_pitch(self, notes: List[NoteEvent], cart_count: int) -> List[List[NoteEvent]]:
+        # Start from pitch ranges holding equal note counts, lowest range on cart 0
+        pitches = sorted(event.note for event in notes)
+        boundaries = [pitches[len(pitches) * i // cart_count] if pitches else 0 for i in range(1, cart_count)]
+        parts = self._split(notes, boundaries)
+        if self.analyzer is None:
+            return parts
+
+        score = self._score(parts)
+        for _ in range(self.max_rounds):
+            best = None
+            for i in range(len(boundaries)):
+                for shift in (-1, 1):
+                    candidate = boundaries[:]
+                    candidate[i] += shift
+                    if (i > 0 and candidate[i] < candidate[i - 1]) or (i < len(candidate) - 1 and candidate[i] > candidate[i + 1]):
+                        continue
+                    candidate_score = self._score(self._split(notes, candidate))
+                    if candidate_score < score and (best is None or candidate_score < best[0]):
+                        best = (candidate_score, candidate)
+            if best is None:
+                break
+            score, boundaries = best
+        return self._split(notes, boundaries)
+
+    def _split(self, notes, boundaries):
+        parts = [[] for _ in range(len(boundaries) + 1)]
+        for event in notes:
+            parts[sum(1 for boundary in boundaries if event.note >= boundary)].append(event)
+        return parts
+
+    def _score(self, parts):
+        # Worst cart first, then the total, then how evenly the notes are spread
+        infeasible = [len(self.analyzer.analyze(self.compile_part(part))['infeasible']) for part in parts]
+        return (max(infeasible), sum(infeasible), max(len(part) for part in parts))
+
+    def compile_part(self, notes: List[NoteEvent], start_position=0) -> List[MotionCommand]:
+        return self.optimizer.optimize(self.converter.compile_notes(notes), start_position)
+
+    def split(self, notes: List[NoteEvent], cart_count: int, strategy='pitch') -> List[List[NoteEvent]]:
+        if strategy == 'track':
+            return self.partition_by_track(notes, cart_count)
+        if strategy == 'pitch':
+            return self.partition_by_pitch(notes, cart_count)
+        raise ValueError(f"Unknown partition strategy: {strategy}")
+
+    def partition(self, notes: List[NoteEvent], cart_count: int, strategy='pitch') -> List[List[MotionCommand]]:
+        parts = self.split(notes, cart_count, strategy)
+        plans = []
+        self.report = []
+        for part in parts:
+            plan = self.compile_part(part)
+            entry = {'notes': len(plan), 'travel': self.optimizer.report['optimized_distance']}
+            if self.analyzer is not None:
+                entry['infeasible'] = len(self.analyzer.analyze(plan)['infeasible'])
+            plans.append(plan)
+            self.report.append(entry)
+        return plans
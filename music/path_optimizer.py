@@ -0,0 +1,73 @@
+# music/path_optimizer.py
+
+from typing import List, Sequence, Tuple
+from music.midi_converter import MotionCommand
+from music.playback import LatencyModel
+
+class PathOptimizer:
+    # Chooses the cart position, servo and side for every note so that the total
+    # stepper travel over the whole song is as small as possible
+    def __init__(self, note_options, latency_model: LatencyModel = None):
+        self.note_options = note_options  # note -> tuple of (position, servo_index, direction) options
+        self.latency = latency_model or LatencyModel()
+        self.report = {}
+
+    def _options_for(self, command: MotionCommand) -> Sequence[Tuple[int, int, int]]:
+        try:
+            options = self.note_options[command.note]
+        except (KeyError, IndexError):
+            options = None
+        return options or ((command.position, command.servo_index, command.direction),)
+
+    def optimize(self, plan: List[MotionCommand], start_position=0) -> List[MotionCommand]:
+        if not plan:
+            self.report = {'naive_distance': 0, 'optimized_distance': 0, 'saved_distance': 0, 'saved_ms': 0}
+            return []
+
+        # Dynamic programming over the note sequence: cost[j] is the least travel
+        # needed to play every note so far and end on option j of the current note
+        options = [self._options_for(command) for command in plan]
+        costs = [abs(position - start_position) for position, _, _ in options[0]]
+        back = [None]
+        for i in range(1, len(plan)):
+            previous = options[i - 1]
+            step_costs = []
+            step_back = []
+            for position, _, _ in options[i]:
+                best = min(range(len(previous)), key=lambda k: costs[k] + abs(position - previous[k][0]))
+                step_costs.append(costs[best] + abs(position - previous[best][0]))
+                step_back.append(best)
+            costs = step_costs
+            back.append(step_back)
+
+        choice = min(range(len(costs)), key=lambda j: costs[j])
+        chosen = [0] * len(plan)
+        for i in range(len(plan) - 1, -1, -1):
+            chosen[i] = choice
+            if i:
+                choice = back[i][choice]
+
+        optimized = []
+        for command, command_options, j in zip(plan, options, chosen):
+            position, servo_index, direction = command_options[j]
+            optimized.append(command._replace(position=position, servo_index=servo_index, direction=direction))
+
+        naive_distance, naive_ms = self._travel(plan, start_position)
+        optimized_distance, optimized_ms = self._travel(optimized, start_position)
+        self.report = {
+            'naive_distance': naive_distance,
+            'optimized_distance': optimized_distance,
+            'saved_distance': naive_distance - optimized_distance,
+            'saved_ms': naive_ms - optimized_ms,
+        }
+        return optimized
+
+    def _travel(self, plan, start_position):
+        distance = 0
+        travel_ms = 0
+        position = start_position
+        for command in plan:
+            distance += abs(command.position - position)
+            travel_ms += self.latency.travel_ms(position, command.position)
+            position = command.position
+        return distance, travel_ms
@@ -0,0 +1,67 @@
+# music/plan_cache.py
+
+import hashlib
+import os
+from typing import List, Optional
+from config import settings
+from music.midi_converter import MotionCommand
+from music.score_format import write_score, ScoreReader
+
+SCORE_EXTENSION = '.cmbt'
+
+class PlanCache:
+    # Compiled plans stored as score files, named by a hash of everything that
+    # went into compiling them, and evicted least-recently-used first
+    def __init__(self, directory=settings.PLAN_CACHE_DIR, max_bytes=settings.PLAN_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, midi_bytes: bytes, *parts) -> str:
+        digest = hashlib.sha256(midi_bytes)
+        digest.update(repr(parts).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + SCORE_EXTENSION)
+
+    def get(self, key: str) -> Optional[List[MotionCommand]]:
+        path = self._path(key)
+        try:
+            with ScoreReader(path) as score:
+                plan = [MotionCommand(*record) for record in score]
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path)  # Mark as recently used
+        self.hits += 1
+        return plan
+
+    def put(self, key: str, plan: List[MotionCommand]):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        temp_path = path + '.tmp'
+        write_score(temp_path, plan)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SCORE_EXTENSION):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        # Always keep the newest entry, even if it alone exceeds the limit
+        while total > self.max_bytes and len(entries) > 1:
+            _, size, name = entries.pop(0)
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions"
@@ -0,0 +1,241 @@
+# music/playback.py
+
+# Runs on the board as well as the host, so no typing or other CPython-only imports.
+
+from config import settings
+from utils.async_helpers import asyncio, ticks_ms, ticks_diff, ticks_add, sleep_ms, sleep_until
+
+class LatencyModel:
+    # Predicts how long each actuator takes, so commands can be issued early
+    def __init__(self, travel_speed=settings.STEPPER_TRAVEL_SPEED,
+                 start_latency_ms=settings.STEPPER_START_LATENCY_MS, estimator=None):
+        self.travel_speed = travel_speed
+        self.estimator = estimator  # e.g. the stepper's TravelTimeEstimator, for accelerated moves
+        self.start_latency_ms = start_latency_ms
+
+    def travel_ms(self, from_position, to_position):
+        if self.estimator is not None:
+            return self.estimator.estimate_ms(from_position, to_position)
+        distance = abs(to_position - from_position)
+        if distance == 0:
+            return 0
+        return self.start_latency_ms + int(distance * 1000 / self.travel_speed)
+
+class HoldPolicy:
+    # Decides how long a servo stays energized after a move, given when the plan
+    # needs it next: 'always' never lets go, 'timed' holds for hold_ms, 'release'
+    # disables at once and 'auto' holds only if the next use is within hold_ms.
+    # Returns a hold for Servo.release: None for indefinitely, 0 for not at all.
+    MODES = ('always', 'timed', 'release', 'auto')
+
+    def __init__(self, mode=settings.SERVO_HOLD_POLICY, hold_ms=settings.SERVO_HOLD_MS, margin_ms=20):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown hold policy: {mode}")
+        self.mode = mode
+        self.hold_ms = hold_ms
+        self.margin_ms = margin_ms  # Covers the next move arriving a little late
+
+    def decide(self, now_ms, next_use_ms):
+        if self.mode == 'always':
+            return None
+        if self.mode == 'release':
+            return 0
+        if self.mode == 'timed':
+            return self.hold_ms
+        if next_use_ms is None or next_use_ms - now_ms > self.hold_ms:
+            return 0
+        return max(0, next_use_ms - now_ms) + self.margin_ms
+
+class PlaybackEngine:
+    def __init__(self, cart, latency_model=None, lead_in_ms=100, hover=True,
+                 hold_policy=None, lookahead=16):
+        self.cart = cart
+        self.latency = latency_model or LatencyModel()
+        self.hold_policy = hold_policy or HoldPolicy()
+        self.lookahead = lookahead  # Chords read ahead to see when each servo is needed next
+        self.lead_in_ms = lead_in_ms  # Head start so the first note can also be issued early
+        self.hover = hover  # Pre-position the next servos while the cart travels
+        self.onset_errors = []  # (note, error_ms) for every note played
+
+    async def play(self, plan, start=None):
+        # Cart moves go through the cart's motion queue. A chord the cart has time
+        # for stops the cart and is struck at its onset; in a passage too fast for
+        # that, the cart glides through without stopping and strikes on arrival.
+        # `start` (ticks_ms of time 0) lets several engines share one clock.
+        self.onset_errors = []
+        self.position = self.cart.get_current_position()
+        self.held = []  # (release_ms, servo_index, is_left_note) of keys still pressed
+        chords = self._chords(plan)
+        self.upcoming = []
+        self._fill(chords)
+        if start is None:
+            start = ticks_add(ticks_ms(), self._lead_in_ms(self.upcoming[0] if self.upcoming else None))
+        self.start = start
+        self.mover = None  # Task running the cart's motion queue
+        self.dwelling = 0  # Queued chords that stop the cart and have not been struck yet
+        self.glides = []  # Strike tasks of chords played on the fly
+
+        while True:
+            self._fill(chords)
+            if not self.upcoming:
+                break
+            chord = self.upcoming.pop(0)
+            time_ms, position = chord[0][0], chord[0][1]
+            servos = [command[2] for command in chord]
+            notes = [(command[2], command[3] < 0) for command in chord]
+            travel_ms = self.latency.travel_ms(self.position, position)
+
+            # The cart leaves only once the chord before has been struck, or right
+            # away when that chord glides
+            await self._wait_dwells()
+            if not travel_ms:
+                await self._wait_moves()
+
+            # A servo that hovered during travel only has the short final stroke left,
+            # provided the travel gives it time to get to the hover angle first
+            hovering = self.hover and travel_ms > 0 and self._idle() and travel_ms >= self.cart.hover_ms(notes)
+            strike_ms = self.cart.strike_ms(notes, hovering)
+            move_at = time_ms - strike_ms - travel_ms
+
+            # Keys due to be released before we have to leave are let go on time;
+            # anything else still held when the cart moves is released early
+            await self._release_due(move_at if travel_ms else time_ms - strike_ms, servos, travel_ms > 0)
+
+            if not travel_ms:
+                await self._strike(chord, notes, strike_ms)
+                continue
+
+            await sleep_until(self.start, move_at)
+            if hovering:
+                self.cart.hover(notes)
+            if self._departure_ms(position) < time_ms:
+                on_arrival = lambda chord=chord, notes=notes: self.glides.append(
+                    asyncio.create_task(self._strike(chord, notes, 0, glide=True)))
+                await self.cart.queue_move(position, on_arrival=on_arrival)
+            else:
+                self.dwelling += 1
+                await self.cart.queue_move(position, dwell=lambda chord=chord, notes=notes, strike_ms=strike_ms:
+                                           self._strike(chord, notes, strike_ms))
+            if self.mover is None or self.mover.done():
+                self.mover = asyncio.create_task(self.cart.run_moves())
+            self.position = position
+
+        await self._wait_moves()
+        await self._release_due(None, (), True)
+        self.position = self.cart.get_current_position()
+        return self.onset_errors
+
+    def _fill(self, chords):
+        if len(self.upcoming) >= self.lookahead:
+            return
+        for chord in chords:
+            self.upcoming.append(chord)
+            if len(self.upcoming) >= self.lookahead:
+                break
+
+    def required_lead_in_ms(self, plan):
+        # Head start play() needs for `plan`, so callers can pick a shared start
+        for chord in self._chords(plan):
+            return self._lead_in_ms(chord)
+        return self.lead_in_ms
+
+    def _lead_in_ms(self, first):
+        # Enough head start for the cart to reach the first chord and strike it on time
+        if first is None:
+            return self.lead_in_ms
+        travel_ms = self.latency.travel_ms(self.cart.get_current_position(), first[0][1])
+        return max(self.lead_in_ms, travel_ms + self._strike_ms(first) - first[0][0])
+
+    def _departure_ms(self, position):
+        # When the cart has to leave `position` for the next chord, if it has to
+        if not self.upcoming:
+            return float('inf')
+        following = self.upcoming[0]
+        travel_ms = self.latency.travel_ms(position, following[0][1])
+        if not travel_ms:
+            return float('inf')
+        return following[0][0] - self._strike_ms(following) - travel_ms
+
+    def _strike_ms(self, chord):
+        return self.cart.strike_ms([(command[2], command[3] < 0) for command in chord])
+
+    def _idle(self):
+        return (self.mover is None or self.mover.done()) and all(task.done() for task in self.glides)
+
+    async def _wait_dwells(self):
+        # A stopped run drops its queued chords, so stop waiting once the queue is done
+        while self.dwelling and not self.mover.done():
+            await sleep_ms(1)
+        self.dwelling = 0
+
+    async def _wait_moves(self):
+        if self.mover is not None:
+            await self.mover
+        if self.glides:
+            await asyncio.gather(*self.glides)
+            self.glides = []
+        self.dwelling = 0
+
+    async def _strike(self, chord, notes, strike_ms, glide=False):
+        time_ms = chord[0][0]
+        if not glide:
+            await sleep_until(self.start, time_ms - strike_ms)
+        # A struck servo is next needed to release its key
+        holds = [self.hold_policy.decide(time_ms, command[4] - self.cart.release_ms([note]))
+                 for command, note in zip(chord, notes)]
+        if len(chord) == 1:
+            await self.cart.play_note(*notes[0], hold_ms=holds[0])
+        else:
+            await self.cart.play_chord(notes, hold_ms=holds)
+        error_ms = ticks_diff(ticks_ms(), self.start) - time_ms
+        for command in chord:
+            self.onset_errors.append((command[5], error_ms))
+            if glide:
+                await self.cart.release_note(command[2])  # The cart is already moving on
+            else:
+                self.held.append((command[4], command[2], command[3] < 0))
+        if not glide:
+            self.dwelling = max(0, self.dwelling - 1)
+
+    def _next_use(self, servo_index):
+        for chord in self.upcoming:
+            if any(command[2] == servo_index for command in chord):
+                return chord[0][0] - self._strike_ms(chord)
+        return None
+
+    def _chords(self, plan):
+        # Consecutive commands with the same onset and position are struck together
+        chord = []
+        for command in plan:
+            if chord and (command[0] != chord[0][0] or command[1] != chord[0][1]):
+                yield chord
+                chord = []
+            chord.append(command)
+        if chord:
+            yield chord
+
+    async def _release_due(self, before_ms, servos, release_all):
+        for release in sorted(self.held):
+            release_ms, held_servo, is_left_note = release
+            if release_all or held_servo in servos or release_ms <= before_ms:
+                if before_ms is not None:
+                    release_ms = min(release_ms, before_ms)
+                await sleep_until(self.start, release_ms - self.cart.release_ms([(held_servo, is_left_note)]))
+                if before_ms is None:
+                    hold_ms = 0  # End of the song
+                else:
+                    next_use = before_ms if held_servo in servos else self._next_use(held_servo)
+                    hold_ms = self.hold_policy.decide(release_ms, next_use)
+                await self.cart.release_note(held_servo, hold_ms=hold_ms)
+                self.held.remove(release)
+
+    def report(self):
+        if not self.onset_errors:
+            return {'notes': 0, 'mean_error_ms': 0, 'max_error_ms': 0, 'late_notes': 0}
+        errors = [error for _, error in self.onset_errors]
+        return {
+            'notes': len(errors),
+            'mean_error_ms': sum(errors) / len(errors),
+            'max_error_ms': max(errors, key=abs),
+            'late_notes': sum(1 for error in errors if error > 0),
+        }
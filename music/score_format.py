@@ -0,0 +1,82 @@
+# music/score_format.py
+
+# Fixed-width binary score files for compiled plans. The reader only needs
+# struct and a small reusable buffer, so it runs on the board without mido.
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+MAGIC = b'CMBT'
+VERSION = 1
+
+# magic, version, record size, record count, duration in ms
+HEADER_FORMAT = '<4sHHII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# time_ms, position, servo_index, direction, release_ms, note (+1 pad byte)
+RECORD_FORMAT = '<IiBbIBx'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+def write_score(path, commands):
+    commands = list(commands)
+    duration_ms = max((command[4] for command in commands), default=0)
+    with open(path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, RECORD_SIZE, len(commands), duration_ms))
+        for time_ms, position, servo_index, direction, release_ms, note in commands:
+            f.write(struct.pack(RECORD_FORMAT, time_ms, position, servo_index, direction, release_ms, note))
+    return HEADER_SIZE + RECORD_SIZE * len(commands)
+
+class ScoreReader:
+    def __init__(self, path, window_records=32):
+        self.file = open(path, 'rb')
+        try:
+            header = self.file.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise ValueError(f"{path} is too short for a score header")
+            magic, version, record_size, self.record_count, self.duration_ms = struct.unpack(HEADER_FORMAT, header)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a Cumbiatron score file")
+            if version != VERSION or record_size != RECORD_SIZE:
+                raise ValueError(f"Unsupported score version {version} with {record_size}-byte records")
+        except Exception:
+            self.file.close()
+            raise
+
+        # One window is reused for every read, so memory use does not grow with the song
+        self.buffer = bytearray(RECORD_SIZE * window_records)
+        self.window = memoryview(self.buffer)
+
+    def __len__(self):
+        return self.record_count
+
+    def __iter__(self):
+        # Records come back as plain tuples in MotionCommand field order
+        self.file.seek(HEADER_SIZE)
+        remaining = self.record_count
+        while remaining:
+            read = self.file.readinto(self.window)
+            count = min((read or 0) // RECORD_SIZE, remaining)
+            if count == 0:
+                raise ValueError(f"Score file truncated, {remaining} records missing")
+            for i in range(count):
+                yield struct.unpack_from(RECORD_FORMAT, self.buffer, i * RECORD_SIZE)
+            remaining -= count
+
+    def read_record(self, index):
+        if index < 0 or index >= self.record_count:
+            raise IndexError("Record index out of range")
+        self.file.seek(HEADER_SIZE + index * RECORD_SIZE)
+        if (self.file.readinto(self.window[:RECORD_SIZE]) or 0) < RECORD_SIZE:
+            raise ValueError(f"Score file truncated at record {index}")
+        return struct.unpack_from(RECORD_FORMAT, self.buffer, 0)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,36 @@
+# music/score_player.py
+
+# Board-side entry point for scores compiled on the host with export_score. It
+# imports only the score reader and the playback engine, so mido, numpy and the
+# compile pipeline never have to be on the board.
+
+from music.score_format import ScoreReader
+from music.playback import PlaybackEngine, LatencyModel
+
+class ScorePlayer:
+    def __init__(self, cart, engine=None):
+        self.cart = cart
+        self.engine = engine or PlaybackEngine(cart, LatencyModel(estimator=cart.stepper.travel_estimator))
+
+    async def play_score(self, score_path):
+        with ScoreReader(score_path) as score:
+            await self.play_plan(score)
+
+    async def play_plan(self, plan, start=None):
+        await self.engine.play(plan, start)
+        report = self.engine.report()
+        print(f"Played {report['notes']} notes, mean onset error {report['mean_error_ms']:.1f} ms, "
+              f"worst {report['max_error_ms']} ms, {report['late_notes']} late")
+        print(f"Servo energized time (ms): {self.cart.energized_report()}")
+
+# Example usage on the board
+if __name__ == "__main__":
+    from utils.async_helpers import asyncio
+    from cart.cumbiatron_cart import CumbiatronCart
+
+    async def play():
+        cart = CumbiatronCart([0, 1, 2, 3, 4, 5, 6], [12, 13, 10, [11, 14, 15], 16], 16, 17)
+        await cart.initialize()
+        await ScorePlayer(cart).play_score('song.cmbt')
+
+    asyncio.run(play())
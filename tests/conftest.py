@@ -0,0 +1,83 @@
+# tests/conftest.py
+
+# The hardware modules import MicroPython's machine, utime and uasyncio. On the
+# host they are replaced by stand-ins on a simulated microsecond clock, so step
+# accounting can be checked against a driver that emits pulses in that time.
+
+import asyncio
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CLOCK = [0]  # Simulated time in microseconds
+
+def _utime():
+    module = types.ModuleType('utime')
+    module.CLOCK = CLOCK
+    module.ticks_us = lambda: CLOCK[0]
+    module.ticks_ms = lambda: CLOCK[0] // 1000
+    module.ticks_diff = lambda end, start: end - start
+    module.ticks_add = lambda ticks, delta: ticks + delta
+
+    def sleep_us(us):
+        CLOCK[0] += max(0, int(us))
+
+    module.sleep_us = sleep_us
+    module.sleep_ms = lambda ms: sleep_us(ms * 1000)
+    return module
+
+def _uasyncio():
+    # One coroutine at a time: a sleep just moves the clock on
+    module = types.ModuleType('uasyncio')
+    module.__dict__.update({name: getattr(asyncio, name) for name in ('Event', 'create_task', 'gather', 'run')})
+
+    async def sleep_ms(ms):
+        CLOCK[0] += max(0, int(ms)) * 1000
+        await asyncio.sleep(0)
+
+    module.sleep_ms = sleep_ms
+    module.sleep = lambda seconds: sleep_ms(seconds * 1000)
+    return module
+
+def _machine():
+    module = types.ModuleType('machine')
+
+    class Pin:
+        IN, OUT, PULL_UP, IRQ_FALLING, IRQ_RISING = 0, 1, 2, 4, 8
+
+        def __init__(self, pin, mode=None, pull=None):
+            self._value = 1
+
+        def value(self, value=None):
+            if value is None:
+                return self._value
+            self._value = int(value)
+
+        def irq(self, trigger=None, handler=None):
+            self.handler = handler
+
+    class PWM:
+        def __init__(self, pin):
+            self._freq = 0
+            self.duty = 0
+
+        def freq(self, value=None):
+            if value is None:
+                return self._freq
+            self._freq = value
+
+        def duty_u16(self, value):
+            self.duty = value
+
+    module.Pin = Pin
+    module.PWM = PWM
+    return module
+
+try:
+    import machine  # noqa: F401
+except ImportError:
+    sys.modules['utime'] = _utime()
+    sys.modules['uasyncio'] = _uasyncio()
+    sys.modules['machine'] = _machine()
@@ -0,0 +1,56 @@
+# tests/test_chord_coalescer.py
+
+import random
+from music.chord_coalescer import ChordCoalescer
+from music.midi_converter import MotionCommand
+from music.note_mapping import KeyboardGeometry, build_note_table
+from music.path_optimizer import PathOptimizer
+
+NOTE_TABLE = build_note_table(KeyboardGeometry(), [1, 1, 1, 1, -1, -1, -1], ['w'] * 4 + ['b'] * 3)
+
+def command(time_ms, note, option=0):
+    return MotionCommand(time_ms, *NOTE_TABLE[note][option], time_ms + 200, note)
+
+def test_near_simultaneous_notes_become_one_chord():
+    coalescer = ChordCoalescer(NOTE_TABLE, 7, window_ms=20)
+    chord = coalescer.coalesce([command(1000, 62), command(1005, 66), command(1012, 69)], 1200)
+    assert len({c.position for c in chord}) == 1
+    assert {c.time_ms for c in chord} == {1000}
+    assert len({c.servo_index for c in chord}) == 3
+    for c in chord:
+        assert (c.position, c.servo_index, c.direction) in NOTE_TABLE[c.note]
+    assert coalescer.report['chords'] == 1
+
+def test_notes_outside_the_window_are_left_alone():
+    coalescer = ChordCoalescer(NOTE_TABLE, 7, window_ms=20)
+    plan = [command(1000, 60), command(1100, 64)]
+    assert coalescer.coalesce(plan, 0) == plan
+    assert coalescer.report['chords'] == 0
+
+def test_shared_position_is_kept_when_nothing_is_nearer():
+    # Between a start on the left and a next note on the right every common
+    # position costs the same travel, so the chord stays where the notes are
+    chord = (62, 66, 69)
+    common = sorted(set.intersection(*[{option[0] for option in NOTE_TABLE[note]} for note in chord]))
+    position = common[-1]
+    notes = [MotionCommand(i * 5, position, *next(option[1:] for option in NOTE_TABLE[note] if option[0] == position),
+                           500, note) for i, note in enumerate(chord)]
+    following = command(1000, 96)
+    assert following.position > position
+    result = ChordCoalescer(NOTE_TABLE, 7).coalesce(notes + [following], common[0] - 100)
+    assert [c.position for c in result[:3]] == [position] * 3
+
+def test_coalescing_never_adds_moves_or_travel():
+    rng = random.Random(3)
+    coalescer = ChordCoalescer(NOTE_TABLE, 7)
+    optimizer = PathOptimizer(NOTE_TABLE)
+    for _ in range(200):
+        notes = []
+        time_ms = 0
+        for _ in range(12):
+            time_ms += rng.choice([0, 5, 10, 200])
+            notes.append(command(time_ms, rng.randint(48, 84)))
+        plan = optimizer.optimize(notes, 0)
+        result = coalescer.coalesce(plan, 0)
+        assert coalescer.report['moves_saved'] >= 0
+        assert sorted(c.note for c in result) == sorted(c.note for c in plan)
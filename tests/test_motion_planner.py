@@ -0,0 +1,70 @@
+# tests/test_motion_planner.py
+
+import random
+import pytest
+from hardware.motion_planner import MotionPlanner
+
+async def dwell():
+    pass
+
+def plan(targets, **kwargs):
+    planner = MotionPlanner(max_speed=2500, max_acceleration=20000, junction_speed=400, buffer_size=64)
+    planner.reset(0)
+    for target in targets:
+        if isinstance(target, tuple):
+            planner.queue_target(target[0], dwell=dwell)
+        else:
+            planner.queue_target(target, **kwargs)
+    return planner
+
+def junctions(planner):
+    return [(move.exit_speed, following.entry_speed) for move, following in zip(planner.queue, planner.queue[1:])]
+
+def test_same_direction_runs_keep_moving_up_to_the_junction_speed():
+    planner = plan([500, 1000, 1500, 2000])
+    for exit_speed, entry_speed in junctions(planner):
+        assert exit_speed == entry_speed == 400
+    assert planner.queue[0].entry_speed == 0
+    assert planner.queue[-1].exit_speed == 0
+
+def test_reversals_dwells_and_repeats_stop_at_the_junction():
+    planner = plan([500, 200, (700,), 900, 900, 1200])
+    assert [exit_speed for exit_speed, _ in junctions(planner)] == [0, 0, 0, 0, 0]
+
+def test_junction_speed_is_limited_by_slow_moves():
+    planner = plan([500, 1000], speed=250)
+    assert junctions(planner) == [(250, 250)]
+
+def test_short_moves_only_reach_what_acceleration_allows():
+    # 2 steps from rest at 20000 steps/s^2 reach at most sqrt(2 * 20000 * 2)
+    planner = plan([2, 4, 1000])
+    assert planner.queue[0].exit_speed == pytest.approx(282.84, abs=0.01)
+    # ...and the last move before a stop may only enter as fast as it can brake
+    planner = plan([1000, 1003])
+    assert planner.queue[1].entry_speed == pytest.approx(346.41, abs=0.01)
+
+def test_every_move_respects_the_acceleration_limit():
+    rng = random.Random(7)
+    for _ in range(50):
+        targets = [rng.randrange(0, 3600) for _ in range(rng.randrange(1, 20))]
+        planner = plan(targets)
+        for move in planner.queue:
+            assert move.entry_speed <= max(move.max_entry_speed, planner.queue[0].entry_speed)
+            assert abs(move.exit_speed ** 2 - move.entry_speed ** 2) <= 2 * 20000 * move.distance + 1e-6
+        for exit_speed, entry_speed in junctions(planner):
+            assert exit_speed == entry_speed <= 400
+        assert planner.queue[-1].exit_speed == 0
+
+def test_popped_exit_speed_becomes_the_next_entry():
+    planner = plan([500, 1000, 1500])
+    move = planner.pop()
+    assert planner.current_speed == move.exit_speed == 400
+    planner.recalculate()
+    assert planner.queue[0].entry_speed == 400
+
+def test_full_buffer_raises():
+    planner = MotionPlanner(buffer_size=1)
+    planner.queue_target(100)
+    assert planner.is_full()
+    with pytest.raises(ValueError):
+        planner.queue_target(200)
@@ -0,0 +1,49 @@
+# tests/test_note_mapping.py
+
+import pytest
+from config import settings
+from music.note_mapping import KeyboardGeometry, build_note_table
+
+ORIENTATIONS = [1, 1, 1, 1, -1, -1, -1]
+KEY_TYPES = ['w'] * 4 + ['b'] * 3
+
+def test_every_option_strikes_its_note():
+    geometry = KeyboardGeometry()
+    table = build_note_table(geometry, ORIENTATIONS, KEY_TYPES)
+    for note, options in enumerate(table):
+        for position, servo_index, direction in options:
+            assert KEY_TYPES[servo_index] == geometry.key_type(note)
+            struck = position + geometry.servo_offsets[servo_index] + direction * geometry.key_pitch // 2
+            assert struck == geometry.key_position(note)
+
+def test_positions_stay_clear_of_the_switches():
+    geometry = KeyboardGeometry()
+    table = build_note_table(geometry, ORIENTATIONS, KEY_TYPES)
+    positions = [option[0] for options in table for option in options]
+    assert min(positions) >= settings.SWITCH_CLEARANCE_STEPS
+    assert max(positions) <= settings.RAIL_LENGTH_STEPS - settings.SWITCH_CLEARANCE_STEPS
+
+def test_options_matching_servo_orientation_come_first():
+    table = build_note_table(KeyboardGeometry(), ORIENTATIONS, KEY_TYPES)
+    for options in table:
+        preferred = [direction == -ORIENTATIONS[servo_index] for _, servo_index, direction in options]
+        assert preferred == sorted(preferred, reverse=True)
+
+def test_out_of_range_notes_are_unreachable():
+    geometry = KeyboardGeometry()
+    table = build_note_table(geometry, ORIENTATIONS, KEY_TYPES)
+    assert len(table) == 128
+    assert table[geometry.lowest_note - 1] == () and table[geometry.highest_note + 1] == ()
+
+@pytest.mark.parametrize('chord', [(62, 66, 69), (60, 63, 67), (61, 65, 68)])
+def test_mixed_chords_share_a_position(chord):
+    table = build_note_table(KeyboardGeometry(), ORIENTATIONS, KEY_TYPES)
+    assert set.intersection(*[{option[0] for option in table[note]} for note in chord])
+
+def test_split_grids_are_reported(capsys):
+    build_note_table(KeyboardGeometry(servo_offsets=[50, 250, 450, 650, 150, 350, 550]), ORIENTATIONS, KEY_TYPES)
+    assert 'Warning' in capsys.readouterr().out
+
+def test_lowest_key_must_be_white():
+    with pytest.raises(ValueError):
+        KeyboardGeometry(lowest_note=37)
@@ -0,0 +1,48 @@
+# tests/test_path_optimizer.py
+
+import itertools
+import random
+from music.midi_converter import MotionCommand
+from music.note_mapping import KeyboardGeometry, build_note_table
+from music.path_optimizer import PathOptimizer
+
+NOTE_TABLE = build_note_table(KeyboardGeometry(), [1, 1, 1, 1, -1, -1, -1], ['w'] * 4 + ['b'] * 3)
+
+def travel(plan, position):
+    distance = 0
+    for command in plan:
+        distance += abs(command.position - position)
+        position = command.position
+    return distance
+
+def make_plan(notes):
+    return [MotionCommand(i * 100, *NOTE_TABLE[note][0], i * 100 + 50, note) for i, note in enumerate(notes)]
+
+def test_optimizer_matches_brute_force():
+    rng = random.Random(4)
+    optimizer = PathOptimizer(NOTE_TABLE)
+    for _ in range(20):
+        plan = make_plan([rng.randint(40, 90) for _ in range(5)])
+        best = min(sum(abs(b - a) for a, b in zip((300,) + positions, positions))
+                   for positions in itertools.product(*[[option[0] for option in NOTE_TABLE[c.note]] for c in plan]))
+        optimized = optimizer.optimize(plan, 300)
+        assert travel(optimized, 300) == best
+        assert optimizer.report['optimized_distance'] == best
+
+def test_optimizer_keeps_notes_and_uses_valid_options():
+    plan = make_plan([60, 64, 67, 72, 61, 66])
+    optimized = PathOptimizer(NOTE_TABLE).optimize(plan, 0)
+    for before, after in zip(plan, optimized):
+        assert (after.time_ms, after.note, after.release_ms) == (before.time_ms, before.note, before.release_ms)
+        assert (after.position, after.servo_index, after.direction) in NOTE_TABLE[after.note]
+
+def test_optimizer_never_travels_further_than_the_defaults():
+    plan = make_plan([48, 84, 50, 82, 52, 80])
+    optimizer = PathOptimizer(NOTE_TABLE)
+    optimizer.optimize(plan, 0)
+    assert optimizer.report['saved_distance'] >= 0
+
+def test_empty_plan():
+    optimizer = PathOptimizer(NOTE_TABLE)
+    assert optimizer.optimize([], 0) == []
+    assert optimizer.report['saved_distance'] == 0
@@ -0,0 +1,65 @@
+# tests/test_score_format.py
+
+import os
+import pytest
+from music.midi_converter import MotionCommand
+from music.plan_cache import PlanCache
+from music.score_format import HEADER_SIZE, RECORD_SIZE, ScoreReader, write_score
+
+PLAN = [MotionCommand(i * 125, i * 100 - 50, i % 7, 1 if i % 2 else -1, i * 125 + 300, 36 + i) for i in range(75)]
+
+def truncate(path, size):
+    with open(path, 'r+b') as f:
+        f.truncate(size)
+
+def test_round_trip_across_several_windows(tmp_path):
+    path = str(tmp_path / 'song.cmbt')
+    assert write_score(path, PLAN) == HEADER_SIZE + RECORD_SIZE * len(PLAN)
+    with ScoreReader(path, window_records=8) as score:
+        assert len(score) == len(PLAN)
+        assert score.duration_ms == PLAN[-1].release_ms
+        assert [MotionCommand(*record) for record in score] == PLAN
+        assert MotionCommand(*score.read_record(40)) == PLAN[40]
+        with pytest.raises(IndexError):
+            score.read_record(len(PLAN))
+
+def test_empty_score(tmp_path):
+    path = str(tmp_path / 'empty.cmbt')
+    write_score(path, [])
+    with ScoreReader(path) as score:
+        assert len(score) == 0
+        assert score.duration_ms == 0
+        assert list(score) == []
+
+def test_truncated_records_raise(tmp_path):
+    path = str(tmp_path / 'song.cmbt')
+    write_score(path, PLAN)
+    truncate(path, HEADER_SIZE + RECORD_SIZE * 50 + 3)
+    with ScoreReader(path, window_records=8) as score:
+        with pytest.raises(ValueError):
+            list(score)
+        with pytest.raises(ValueError):
+            score.read_record(50)
+        assert MotionCommand(*score.read_record(49)) == PLAN[49]
+
+@pytest.mark.parametrize('contents', [b'CMB', b'NOPE' + bytes(HEADER_SIZE)])
+def test_bad_header_raises_and_closes_the_file(tmp_path, monkeypatch, contents):
+    path = str(tmp_path / 'bad.cmbt')
+    with open(path, 'wb') as f:
+        f.write(contents)
+    opened = []
+    real_open = open
+    monkeypatch.setattr('builtins.open', lambda *args: opened.append(real_open(*args)) or opened[-1])
+    with pytest.raises(ValueError):
+        ScoreReader(path)
+    assert opened and opened[0].closed
+
+def test_cache_counts_a_truncated_entry_as_a_miss(tmp_path):
+    cache = PlanCache(str(tmp_path), max_bytes=1 << 20)
+    key = cache.key(b'MThd', 'song')
+    cache.put(key, PLAN)
+    assert cache.get(key) == PLAN
+    truncate(cache._path(key), HEADER_SIZE + RECORD_SIZE * 10)
+    assert cache.get(key) is None
+    assert cache.get(cache.key(b'other')) is None
+    assert (cache.hits, cache.misses) == (1, 2)
@@ -0,0 +1,127 @@
+# tests/test_step_accounting.py
+
+import asyncio
+import pytest
+import utime
+from hardware.motion_profile import MotionProfile, TrapezoidProfile, microstep_segments
+from hardware.stepper import StepperMotorController
+
+RESOLUTION = StepperMotorController.MICROSTEP_RESOLUTION
+
+class SimulatedDriver:
+    # Stands in for the step PWM: integrates the pulses really emitted, in 1/32
+    # steps, at the commanded rate, mode and direction over the simulated clock.
+    # `overhead_us` is spent after every new rate, with the new rate running.
+    def __init__(self, stepper, overhead_us=0):
+        self.stepper = stepper
+        self.overhead_us = overhead_us
+        self.rate = 0
+        self.running = False
+        self.since = utime.CLOCK[0]
+        self.mode = stepper.current_microstep
+        self.direction = stepper.direction
+        self.units = stepper.position_units
+        stepper.pwm = self
+        set_mode, set_direction = stepper.set_microstep_mode, stepper.set_direction
+
+        def microstep_mode(microstep):
+            self._flush()
+            set_mode(microstep)
+
+        def direction(value):
+            self._flush()
+            set_direction(value)
+
+        stepper.set_microstep_mode = microstep_mode
+        stepper.set_direction = direction
+
+    def _flush(self):
+        now = utime.CLOCK[0]
+        if self.running:
+            self.units += self.direction * self.rate * (now - self.since) / 1_000_000 * (RESOLUTION // self.mode)
+        self.since = now
+        self.mode = self.stepper.current_microstep
+        self.direction = self.stepper.direction
+
+    def freq(self, value=None):
+        if value is None:
+            return self.rate
+        self._flush()
+        self.rate = value
+        utime.CLOCK[0] += self.overhead_us
+
+    def duty_u16(self, value):
+        self._flush()
+        self.running = value > 0
+
+    def position(self):
+        self._flush()
+        return self.units / RESOLUTION
+
+def make_stepper(overhead_us=0):
+    stepper = StepperMotorController(12, 13, 10, [11, 14, 15], 16)
+    stepper.reset_position(0)
+    return stepper, SimulatedDriver(stepper, overhead_us)
+
+@pytest.mark.parametrize('distance, jerk', [(3000, None), (7.25, None), (0.03125, None), (1500, 200000)])
+def test_microstep_segments_cover_the_exact_distance(distance, jerk):
+    profile = MotionProfile(distance, 2500, 20000, jerk)
+    for start_units in (0, 5, 31):
+        segments = microstep_segments(profile, start_units, 1, 16, 1, 300, 20, 50000, RESOLUTION)
+        assert sum(count * (RESOLUTION // mode) for _, count, mode in segments) == round(distance * RESOLUTION)
+
+def test_microstep_segments_only_switch_on_step_boundaries():
+    segments = microstep_segments(MotionProfile(1000, 2500, 20000), 3, 1, 16, 1, 300, 20, 50000, RESOLUTION)
+    position = 3
+    for _, count, mode in segments:
+        assert position % (RESOLUTION // mode) == 0
+        position += count * (RESOLUTION // mode)
+
+def test_profiles_end_at_their_distance():
+    for profile in (MotionProfile(800, 2500, 20000), MotionProfile(800, 2500, 20000, 200000),
+                    TrapezoidProfile(800, 2500, 20000, 400, 200)):
+        assert profile.position_at(profile.duration) == pytest.approx(800)
+        assert profile.position_at(profile.duration / 2) < 800
+
+@pytest.mark.parametrize('overhead_us', [0, 100, 300])
+def test_async_moves_report_the_pulses_really_emitted(overhead_us):
+    stepper, driver = make_stepper(overhead_us)
+
+    async def moves():
+        for target in (3000, 100, 2000):
+            await stepper.move_to_steps_async(target)
+            assert stepper.position == target
+            assert driver.position() == pytest.approx(target, abs=0.05)
+
+    asyncio.run(moves())
+
+@pytest.mark.parametrize('overhead_us', [0, 100, 300])
+def test_blocking_moves_report_the_pulses_really_emitted(overhead_us):
+    stepper, driver = make_stepper(overhead_us)
+    for target in (3000, 100):
+        stepper.move_to_steps(target)
+        assert stepper.position == target
+        assert driver.position() == pytest.approx(target, abs=0.05)
+
+def test_late_sleeps_are_made_up_in_later_rows(monkeypatch):
+    stepper, driver = make_stepper()
+    sleep_us = utime.sleep_us
+    monkeypatch.setattr(utime, 'sleep_us', lambda us: sleep_us(us + 250))
+    stepper.move_to_steps(1500)
+    assert stepper.position == pytest.approx(driver.position(), abs=0.05)
+    assert stepper.position == pytest.approx(1500, abs=0.25)
+
+def test_stopped_move_counts_up_to_the_stop():
+    stepper, driver = make_stepper()
+
+    async def move():
+        stop_at = utime.CLOCK[0] + 200_000
+        task = asyncio.create_task(stepper.move_to_steps_async(2000))
+        while utime.CLOCK[0] < stop_at and not task.done():
+            await asyncio.sleep(0)
+        stepper.emergency_stop()
+        await task
+
+    asyncio.run(move())
+    assert 0 < stepper.position < 2000
+    assert stepper.position == pytest.approx(driver.position(), abs=0.05)
@@ -0,0 +1,33 @@
+# utils/async_helpers.py
+
+# Timing helpers shared by the players so the same code runs under MicroPython
+# (uasyncio/utime) and on a host with CPython's asyncio.
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    from utime import ticks_ms, ticks_diff, ticks_add
+except ImportError:
+    import time
+
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+async def sleep_ms(ms):
+    if ms > 0:
+        await asyncio.sleep(ms / 1000)
+
+async def sleep_until(start_ticks, offset_ms):
+    # Sleep until `offset_ms` after `start_ticks`, returning how late we woke up (ms)
+    deadline = ticks_add(start_ticks, offset_ms)
+    await sleep_ms(ticks_diff(deadline, ticks_ms()))
+    return ticks_diff(ticks_ms(), deadline)